@@ -0,0 +1,101 @@
+"""
+Compares per-recipient formatting against encode-once fan-out for a channel
+message, and against BridgeChannel.send_message encoding once per combination of
+capabilities when half of the clients have server-time and message-tags. Run
+with `python -m benchmarks.broadcast` from the repository root.
+"""
+
+import timeit
+
+from iridium.irc import MESSAGE_CAPS, IRCSession, encode
+from iridium.server import BridgeChannel
+
+
+class Transport:
+    def write(self, data):
+        pass
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+class Server:
+    name = "Iridium"
+
+
+class Sender:
+    nickname = "discord_user"
+    username = "discord_user"
+    hostname = "discord.gg"
+
+    def __str__(self):
+        return f"{self.nickname}!{self.username}@{self.hostname}"
+
+
+class Channel:
+    irc_name = "#general"
+
+
+def make_sessions(count):
+    sessions = []
+    for n in range(count):
+        session = IRCSession(Server())
+        session.transport = Transport()
+        session.nickname = f"user{n}"
+        sessions.append(session)
+    return sessions
+
+
+def per_recipient(sessions, sender, channel, content):
+    # Formatting the line for each recipient, as channel messages used to be.
+    for session in sessions:
+        if session.nickname != sender.nickname:
+            session.write("PRIVMSG", channel.irc_name, content, prefix=sender)
+
+
+def encode_once(sessions, sender, channel, content):
+    data = encode("PRIVMSG", channel.irc_name, content, prefix=sender)
+    for session in sessions:
+        if session.nickname != sender.nickname:
+            session.send(data)
+
+
+def tagged(sessions, sender, channel, content):
+    channel.bridged.send_message(content, sender, msgid=1234)
+
+
+def main():
+    sender = Sender()
+    channel = Channel()
+    channel.bridged = BridgeChannel("general")
+    content = "hey everyone, the build is green again :tada: " * 3
+    print(
+        f"{'recipients':>10} {'per-recipient':>16} {'encode-once':>16} {'tagged':>16}"
+    )
+    for count in (10, 100, 500, 2000):
+        sessions = make_sessions(count)
+        for session in sessions[::2]:
+            session.message_caps = MESSAGE_CAPS & {"server-time", "message-tags"}
+        channel.bridged.sessions = dict.fromkeys(sessions)
+        number = max(1, 20000 // count)
+        results = []
+        for func in (per_recipient, encode_once, tagged):
+            elapsed = min(
+                timeit.repeat(
+                    lambda: func(sessions, sender, channel, content),
+                    number=number,
+                    repeat=5,
+                )
+            )
+            results.append(elapsed / number / count * 1e9)
+        print(
+            f"{count:>10} {results[0]:>13.0f} ns {results[1]:>13.0f} ns"
+            f" {results[2]:>13.0f} ns  (per recipient)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Measures the latency of handling `!math 1+1`, importing and reloading the
+command module on every invocation as the bridge used to, against resolving
+the handler once through CommandRegistry. Run with
+`python -m benchmarks.commands` from the repository root.
+"""
+
+import asyncio
+import importlib
+import time
+
+from iridium.commands import CommandRegistry
+
+COUNT = 2000
+
+
+class Message:
+    async def reply(self, text):
+        pass
+
+
+async def reload_each_time(message):
+    mod = importlib.import_module("iridium.commands.math")
+    mod = importlib.reload(mod)
+    await mod.handle(message, "1+1")
+
+
+async def registry_lookup(message, registry):
+    handler, options = registry.get("math")
+    await handler(message, "1+1", **options)
+
+
+async def main():
+    message = Message()
+    registry = CommandRegistry({"math": {}})
+    for name, call in (
+        ("import + reload", lambda: reload_each_time(message)),
+        ("registry", lambda: registry_lookup(message, registry)),
+    ):
+        await call()
+        start = time.perf_counter()
+        for _ in range(COUNT):
+            await call()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>16}: {elapsed / COUNT * 1e6:,.1f} us per !math 1+1")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
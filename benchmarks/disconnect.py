@@ -0,0 +1,87 @@
+"""
+Measures 2000 clients disconnecting at once, as when a load balancer in front
+of the server restarts. Each client is in 5 of 50 channels. Compares the old
+way, where every channel of the server broadcast a QUIT and removed the client
+from a list, against Server.disconnected, which tells each peer once. Run with
+`python -m benchmarks.disconnect` from the repository root.
+"""
+
+import asyncio
+import random
+import time
+
+from iridium.irc import IRCSession, encode
+from iridium.server import BridgeChannel, Server
+
+CLIENTS = 2000
+CHANNELS = 50
+JOINED = 5
+
+
+class Transport:
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, data):
+        self.lines += data.count(b"\n")
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+def setup():
+    rng = random.Random(0)
+    server = Server({})
+    for id in range(CHANNELS):
+        server.channels[id] = BridgeChannel(f"channel{id}", server=server, id=id)
+    sessions = []
+    for n in range(CLIENTS):
+        session = IRCSession(server)
+        session.transport = Transport()
+        session.nickname = session.username = f"client{n}"
+        session.hostname = "127.0.0.1"
+        server.sessions[session] = None
+        for id in rng.sample(range(CHANNELS), JOINED):
+            server.channels[id].join(session)
+        sessions.append(session)
+    for session in sessions:
+        session.transport.lines = 0
+    return server, sessions
+
+
+def old_disconnect(channels, sessions, session):
+    # What Server.disconnected used to do, with lists of sessions.
+    for channel in channels:
+        data = encode("QUIT", session.quit_reason, prefix=session)
+        for other in channel:
+            other.send(data)
+        if session in channel:
+            channel.remove(session)
+    sessions.remove(session)
+
+
+async def main():
+    server, sessions = setup()
+    channels = [list(c.sessions) for c in server.channels.values()]
+    connected = list(sessions)
+    start = time.perf_counter()
+    for session in sessions:
+        old_disconnect(channels, connected, session)
+    elapsed = time.perf_counter() - start
+    lines = sum(s.transport.lines for s in sessions)
+    print(f"old: {elapsed:.3f} s, {lines} QUIT lines written")
+
+    server, sessions = setup()
+    start = time.perf_counter()
+    for session in sessions:
+        await server.disconnected(session)
+    elapsed = time.perf_counter() - start
+    lines = sum(s.transport.lines for s in sessions)
+    print(f"new: {elapsed:.3f} s, {lines} QUIT lines written")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+"""
+Times math command expressions three ways: parsing and walking the expression
+tree on every call (as evaluate used to), compiling to a stack program on every
+call, and evaluating through the Engine's cache of compiled programs. Run with
+`python -m benchmarks.expressions` from the repository root.
+"""
+
+import timeit
+
+from iridium.commands.math.expr import compile, run, simplify
+from iridium.commands.math.parser import Engine
+
+EXPRESSIONS = {
+    "simple": "1+1",
+    "functions": "sqrt(16) + log2(8) * sin(0.5) - floor(2.7) / ceil(1.2)",
+    "nested 200": "(" * 200 + "1+2" + ")*2" * 200,
+    "nested 900": "(" * 900 + "1" + ")" * 900,
+    "chain 500": "+".join(str(n) for n in range(500)),
+    "chain 5000": "-".join(str(n) for n in range(5000)),
+    "mixed chain": "*".join(f"({n}+1)/{n + 1}" for n in range(1, 300)),
+    "vector 1k": "stdev(sqrt(1..1000) * 2 + 1)",
+    "vector 100k": "stdev(sqrt(1..99999) * 2 + 1)",
+}
+
+
+def main():
+    engine = Engine()
+    print(f"{'expression':>12} {'tree walk':>12} {'compile':>12} {'cached':>12}")
+    for name, source in EXPRESSIONS.items():
+        strategies = (
+            lambda: simplify(engine.parser.parse(source, lexer=engine.lexer).eval()),
+            lambda: simplify(run(compile(engine.parser.parse(source)))),
+            lambda: engine.evaluate(source),
+        )
+        results = []
+        for func in strategies:
+            try:
+                number = 20
+                elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number
+                results.append(f"{elapsed * 1e6:>9,.0f} us")
+            except RecursionError:
+                results.append(f"{'recursion':>12}")
+        print(f"{name:>12} " + " ".join(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Compares the old split-the-whole-buffer line handling against LineFramer when
+the same input arrives in 1 byte, 4 KiB and 1 MiB chunks. Run with
+`python -m benchmarks.framing` from the repository root.
+"""
+
+import time
+
+from iridium.irc import LineFramer
+
+
+class SplitFramer:
+    # The framing data_received used to do inline.
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\r\n")
+        return lines
+
+
+def chunks(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def run(framer, pieces):
+    start = time.perf_counter()
+    count = 0
+    for piece in pieces:
+        count += len(framer.feed(piece))
+    return time.perf_counter() - start, count
+
+
+def main():
+    line = b"PRIVMSG #general :" + b"x" * 60 + b"\r\n"
+    streams = {
+        "1 MiB of lines": line * ((1 << 20) // len(line)),
+        # A client that never sends a line ending, like a stuck paste.
+        "64 KiB no CRLF": b"x" * (64 << 10),
+    }
+    print(f"{'input':>16} {'chunk':>8} {'split':>12} {'framer':>12}")
+    for name, data in streams.items():
+        for label, size in (("1 B", 1), ("4 KiB", 4 << 10), ("1 MiB", 1 << 20)):
+            pieces = chunks(data, size)
+            old, _ = run(SplitFramer(), pieces)
+            new, _ = run(LineFramer(), pieces)
+            print(f"{name:>16} {label:>8} {old * 1e3:>9.1f} ms {new * 1e3:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Measures 2000 clients sending LIST on connect to a server with 150 channels,
+formatting every line for every request (the way handle_LIST used to) against
+the cached LIST lines, and with ELIST filters evaluated against their index.
+Checks the filters against a plain scan of the channels. Run with
+`python -m benchmarks.listing` from the repository root.
+"""
+
+import random
+import re
+import timeit
+from datetime import datetime, timezone
+
+from iridium.constants import RPL
+from iridium.irc import IRCSession
+from iridium.server import BridgeChannel, Server
+
+CHANNELS = 150
+CLIENTS = 2000
+QUERIES = ["", ">20", "<5", "#dev*", "!*-*,>10", "T<60", "T>60,<30", "#general"]
+
+
+class Transport:
+    def write(self, data):
+        pass
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+def old_list(session):
+    session.write(RPL.LISTSTART, session.nickname, "Channel Users Topic")
+    for channel in session.server.channels.values():
+        session.write(
+            RPL.LIST,
+            session.nickname,
+            channel.irc_name,
+            str(channel.num_users),
+            channel.topic,
+        )
+    session.write(RPL.LISTEND, session.nickname, "End of LIST")
+
+
+def scan(server, query):
+    # What each ELIST query should match, checked one channel at a time.
+    now = datetime.now(timezone.utc).timestamp()
+    masks = []
+    matched = []
+    for channel in server.channels.values():
+        name = channel.irc_name
+        ok = True
+        for item in query.split(","):
+            if item.startswith(">"):
+                ok &= channel.num_users > int(item[1:])
+            elif item.startswith("<"):
+                ok &= channel.num_users < int(item[1:])
+            elif item.startswith("T<"):
+                ok &= channel.topic_time > now - int(item[2:]) * 60
+            elif item.startswith("T>"):
+                ok &= channel.topic_time < now - int(item[2:]) * 60
+            elif item.startswith("!"):
+                ok &= not re.fullmatch(item[1:].replace("*", ".*"), name)
+            elif item:
+                masks.append(item)
+        if masks and not any(re.fullmatch(m.replace("*", ".*"), name) for m in masks):
+            ok = False
+        if ok:
+            matched.append(name)
+    return matched
+
+
+def main():
+    rng = random.Random(0)
+    server = Server({})
+    now = datetime.now(timezone.utc).timestamp()
+    for id in range(CHANNELS):
+        name = rng.choice(["dev", "general", "random", "ops"]) + f"-{id}"
+        if id == 0:
+            name = "general"
+        channel = BridgeChannel(name, server=server, id=id)
+        channel.topic = f"all about {name} " * rng.randrange(0, 5)
+        channel.topic_time = rng.choice([0, now - 600, now - 7200])
+        channel.members = {n: None for n in range(rng.randrange(0, 40))}
+        server.channels[id] = channel
+        server.channel_ids[name] = id
+    for query in QUERIES:
+        lines = server.list_lines(query)
+        names = [line.split()[0].decode() for line in lines]
+        assert names == scan(server, query), query
+        print(f"{query!r:>12}: {len(lines)} channels")
+
+    session = IRCSession(server)
+    session.transport = Transport()
+    session.nickname = "client"
+    cases = {
+        "old": lambda: old_list(session),
+        "cached": lambda: session.handle_LIST(),
+        "cached >20": lambda: session.handle_LIST(">20"),
+        "cached #dev*": lambda: session.handle_LIST("#dev*"),
+    }
+    for name, func in cases.items():
+        elapsed = timeit.timeit(func, number=CLIENTS)
+        print(f"{name:>14}: {elapsed * 1e3:8.1f} ms for {CLIENTS} clients")
+
+
+if __name__ == "__main__":
+    main()
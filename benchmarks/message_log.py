@@ -0,0 +1,73 @@
+"""
+Compares logging 10k messages with one autocommitted INSERT per message against
+the batched MessageLog writer. Run with `python -m benchmarks.message_log` from
+the repository root.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+import aiosqlite
+
+from iridium.log import MessageLog
+
+COUNT = 10000
+
+
+def rows():
+    for n in range(COUNT):
+        yield (n + 1, 1600000000 + n, 1, "general", f"user{n % 50}", f"message {n}")
+
+
+async def per_row(path):
+    db = await aiosqlite.connect(path, isolation_level=None)
+    await db.execute(
+        """
+        CREATE TABLE logs (
+            id INTEGER PRIMARY KEY,
+            timestamp INTEGER,
+            channel_id INTEGER,
+            channel TEXT,
+            nickname TEXT,
+            message TEXT
+        )
+        """
+    )
+    start = time.perf_counter()
+    for row in rows():
+        await db.execute(
+            """
+            INSERT INTO logs (id, timestamp, channel_id, channel, nickname, message)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            row,
+        )
+    elapsed = time.perf_counter() - start
+    await db.close()
+    return elapsed
+
+
+async def batched(path):
+    log = MessageLog(path)
+    await log.open()
+    start = time.perf_counter()
+    for n, row in enumerate(rows()):
+        log.add(row)
+        if n % 10 == 0:
+            # Give the writer a chance to run, as the event loop would.
+            await asyncio.sleep(0)
+    await log.close()
+    return time.perf_counter() - start
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func in (("per-row", per_row), ("batched", batched)):
+            elapsed = await func(os.path.join(tmp, f"{name}.db"))
+            print(f"{name:>8}: {elapsed:.2f} s, {COUNT / elapsed:,.0f} messages/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""
+Measures sending NAMES and WHO for a channel with 5000 Discord members to 2000
+clients rejoining at once, as after a netsplit. Compares formatting the reply
+for every client (as one NAMES line, the way handle_JOIN used to) against the
+reply each channel encodes once and reuses until its membership changes.
+Checks that every line fits in 512 bytes. Run with `python -m benchmarks.names`
+from the repository root.
+"""
+
+import random
+import timeit
+
+from iridium.constants import RPL
+from iridium.irc import MAX_LINE, IRCSession
+from iridium.server import BridgeChannel, Server
+
+MEMBERS = 5000
+CLIENTS = 2000
+
+
+class Transport:
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+class Member:
+    def __init__(self, rng, n):
+        self.nickname = "".join(rng.choice("abcdefghijk_") for _ in range(8)) + str(n)
+        self.username = self.nickname
+        self.hostname = "discord.gg"
+        self.realname = self.nickname.title()
+
+
+def old_names(session, channel):
+    session.write(
+        RPL.NAMREPLY,
+        session.nickname,
+        "=",
+        channel.irc_name,
+        " ".join(u.nickname for u in channel.users()),
+    )
+    session.write(
+        RPL.ENDOFNAMES, session.nickname, channel.irc_name, "End of NAMES list"
+    )
+
+
+def old_who(session, channel):
+    for user in channel.users():
+        session.write(
+            RPL.WHOREPLY,
+            session.nickname,
+            channel.irc_name,
+            user.username,
+            user.hostname,
+            session.server.name,
+            user.nickname,
+            "H",
+            "0 " + user.realname,
+        )
+    session.write(RPL.ENDOFWHO, session.nickname, channel.irc_name, "End of WHO list")
+
+
+def check(sessions, channel):
+    for session in sessions:
+        session.transport.data.clear()
+        session.send_reply(channel.reply("names", session.nickname))
+        session.send_reply(channel.reply("who", session.nickname))
+        data = b"".join(session.transport.data)
+        lines = data.split(b"\r\n")[:-1]
+        assert all(len(line) + 2 <= MAX_LINE for line in lines)
+        names = set()
+        for line in lines:
+            if b" 353 " in line:
+                names.update(line.split(b" :", 1)[1].decode().split())
+        assert names == {u.nickname for u in channel.users()}
+
+
+def main():
+    rng = random.Random(0)
+    server = Server({})
+    channel = BridgeChannel("general", server=server, id=1)
+    channel.members = {n: Member(rng, n) for n in range(MEMBERS)}
+    sessions = []
+    for n in range(CLIENTS):
+        session = IRCSession(server)
+        session.transport = Transport()
+        session.nickname = f"client{n}"
+        sessions.append(session)
+    # Nicknames around and over NICK_ROOM, which get replies of their own.
+    for length in (1, 63, 64, 65, 200):
+        sessions[0].nickname = "x" * length
+        check(sessions[:1], channel)
+    sessions[0].nickname = "client0"
+    check(sessions, channel)
+
+    def storm(send):
+        for session in sessions:
+            send(session)
+            session.transport.data.clear()
+
+    def uncached(session):
+        channel.invalidate()
+        session.send_reply(channel.reply("names", session.nickname))
+
+    cases = {
+        "old names": lambda session: old_names(session, channel),
+        "uncached names": uncached,
+        "cached names": lambda s: s.send_reply(channel.reply("names", s.nickname)),
+        "old who": lambda session: old_who(session, channel),
+        "cached who": lambda s: s.send_reply(channel.reply("who", s.nickname)),
+    }
+    for name, send in cases.items():
+        elapsed = min(timeit.repeat(lambda: storm(send), number=1, repeat=3))
+        print(f"{name:>15}: {elapsed * 1e3:8.1f} ms for {CLIENTS} clients")
+
+
+if __name__ == "__main__":
+    main()
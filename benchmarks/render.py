@@ -0,0 +1,129 @@
+"""
+Compares rendering Discord messages for IRC the way on_message used to (clean
+content, then a per-line findall and replace for custom emoji) against the
+single-pass Renderer, cold and cached. Run with `python -m benchmarks.render`
+from the repository root.
+"""
+
+import random
+import re
+import timeit
+from types import SimpleNamespace
+
+from iridium.render import EMOJI_URL, Renderer
+
+CORPUS = [
+    "lgtm",
+    "the build is green again <:party:394857394857394857>",
+    "**heads up**: deploying in 5 minutes, ping <@!123456789012345678> if it breaks",
+    "can someone look at <#223456789012345678>? `make test` fails on ~~main~~ dev",
+    "```py\nfor n in range(10):\n    print(n * 2)\n```",
+    "||spoiler: it was DNS|| <a:blob:594857394857394857> <a:blob:594857394857394857>",
+    "line one\nline two with *emphasis*\nline three with __underline__ and _more_",
+    "snake_case_names and 2 * 3 * 4 shouldn't turn into formatting",
+    "<@&323456789012345678> standup in 10 <:coffee:494857394857394857>",
+]
+
+
+def make_message(n, content):
+    names = {
+        123456789012345678: SimpleNamespace(
+            id=123456789012345678, display_name="Alice"
+        ),
+        323456789012345678: SimpleNamespace(id=323456789012345678, name="team"),
+        223456789012345678: SimpleNamespace(id=223456789012345678, name="builds"),
+    }
+    mentioned = [i for i in names if str(i) in content]
+    attachments = []
+    if n % 10 == 0:
+        attachments.append(
+            SimpleNamespace(
+                url="https://cdn.discordapp.com/attachments/1/2/log.txt",
+                filename="log.txt",
+                size=12345,
+            )
+        )
+    return SimpleNamespace(
+        id=n,
+        edited_at=None,
+        content=content,
+        author=SimpleNamespace(name="bob"),
+        mentions=[names[i] for i in mentioned if i == 123456789012345678],
+        role_mentions=[names[i] for i in mentioned if i == 323456789012345678],
+        channel_mentions=[names[i] for i in mentioned if i == 223456789012345678],
+        attachments=attachments,
+    )
+
+
+def clean_content(message):
+    # What discord.py 1.7's Message.clean_content does on each access.
+    transformations = {
+        re.escape("<#%s>" % channel.id): "#" + channel.name
+        for channel in message.channel_mentions
+    }
+    for member in message.mentions:
+        transformations[re.escape("<@%s>" % member.id)] = "@" + member.display_name
+        transformations[re.escape("<@!%s>" % member.id)] = "@" + member.display_name
+    for role in message.role_mentions:
+        transformations[re.escape("<@&%s>" % role.id)] = "@" + role.name
+
+    def repl(obj):
+        return transformations.get(re.escape(obj.group(0)), "")
+
+    pattern = re.compile("|".join(transformations.keys()))
+    result = pattern.sub(repl, message.content)
+    return re.sub(r"@(everyone|here|[!&]?[0-9]{17,20})", "@\u200b\\1", result)
+
+
+def old_render(message):
+    lines = []
+
+    def send(text):
+        custom_emoji = re.findall(r"(<a?:(\w*):(\d*)>)", text)
+        for ce in custom_emoji:
+            text = text.replace(ce[0], f"{EMOJI_URL}{ce[2]}.png")
+        lines.append(text)
+
+    def sendmsg(message):
+        for line in clean_content(message).splitlines():
+            send(line)
+
+    sendmsg(message)
+    for att in message.attachments:
+        send(f"{att.url} ({att.filename} - {att.size})")
+    return lines
+
+
+def main():
+    random.seed(0)
+    messages = [make_message(n, random.choice(CORPUS)) for n in range(10000)]
+    for content in CORPUS:
+        print(repr(content))
+        for line in Renderer().lines(make_message(1, content)):
+            print("   ", repr(line))
+    print()
+
+    def cold():
+        renderer = Renderer(size=len(messages))
+        for message in messages:
+            renderer.lines(message)
+        return renderer
+
+    warm = cold()
+
+    def cached():
+        for message in messages:
+            warm.lines(message)
+            warm.quote(message)
+
+    for name, func in (
+        ("old", lambda: [old_render(message) for message in messages]),
+        ("renderer", cold),
+        ("cached", cached),
+    ):
+        elapsed = min(timeit.repeat(func, number=1, repeat=5))
+        print(f"{name:>10}: {elapsed / len(messages) * 1e6:.2f} us per message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Times the outbound line splitter on short and long text in several scripts.
+The checks that its lines fit and reassemble are in tests/test_irc.py. Run with
+`python -m benchmarks.splitting` from the repository root.
+"""
+
+import timeit
+
+from iridium.irc import encode, encode_multiline, split_text
+
+
+def main():
+    cases = {
+        "short": "hey, is the build green again?",
+        "2000 ascii": "lorem ipsum dolor sit amet " * 74,
+        "2000 emoji": "🎉" * 2000,
+        "no spaces": "x" * 2000,
+        "40 lines": "\n".join(f"    print({n})" for n in range(40)),
+    }
+    prefix = "someone!someone@discord.gg"
+    print(f"{'text':>12} {'split_text':>12} {'encode':>12} {'multiline':>12}")
+    for name, text in cases.items():
+        times = []
+        for func in (
+            lambda: split_text(text, 450),
+            lambda: encode("PRIVMSG", "#general", text, prefix=prefix),
+            lambda: encode_multiline("#general", text, prefix=prefix),
+        ):
+            number = 2000
+            elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number
+            times.append(f"{elapsed * 1e6:>9.2f} us")
+        print(f"{name:>12} " + " ".join(times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measures configuring 150 bridged channels against a fake guild whose webhook
+calls take 50 ms, as the REST API would. Compares fetching every webhook during
+startup, one channel at a time, against looking them up lazily, with a cold and
+a warm webhook cache. Run with `python -m benchmarks.startup` from the
+repository root.
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from iridium.bridge import get_user_proxies
+from iridium.log import MessageLog
+from iridium.server import Server
+
+CHANNELS = 150
+LATENCY = 0.05
+
+
+class Webhook:
+    def __init__(self, id, name="IRC"):
+        self.id = id
+        self.name = name
+        self.token = f"token{id}"
+
+
+class Channel:
+    def __init__(self, id):
+        self.id = id
+        self.name = f"channel{id}"
+        self.topic = ""
+        self.members = []
+
+    async def webhooks(self):
+        await asyncio.sleep(LATENCY)
+        return [Webhook(self.id)]
+
+
+class Guild:
+    def __init__(self):
+        self.text_channels = [Channel(n) for n in range(CHANNELS)]
+
+
+class Bridge:
+    def __init__(self):
+        self.guild = Guild()
+        self.by_id = {c.id: c for c in self.guild.text_channels}
+
+    def named_channel(self, name):
+        for channel in self.guild.text_channels:
+            if channel.name == name:
+                return channel
+
+    def get_channel(self, id):
+        return self.by_id.get(id)
+
+    def partial_webhook(self, webhook_id, token):
+        return Webhook(webhook_id)
+
+
+async def sequential(bridge):
+    # What configure used to do for every channel before listening.
+    for channel in bridge.guild.text_channels:
+        channel = bridge.named_channel(channel.name)
+        for hook in await channel.webhooks():
+            if hook.name == "IRC":
+                break
+        get_user_proxies(channel)
+
+
+async def lazy(server):
+    server.channels = {}
+    server.channel_ids = {}
+    start = time.perf_counter()
+    await server.reconfigure()
+    startup = time.perf_counter() - start
+    start = time.perf_counter()
+    await asyncio.gather(*(c.get_webhook() for c in server.channels.values()))
+    return startup, time.perf_counter() - start
+
+
+async def main():
+    bridge = Bridge()
+    start = time.perf_counter()
+    await sequential(bridge)
+    print(f"sequential startup: {time.perf_counter() - start:.2f} s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = Server({"discord": {}})
+        server.bridge = bridge
+        server.db = MessageLog(os.path.join(tmp, "iridium.db"))
+        await server.db.open()
+        for cache in ("cold", "warm"):
+            startup, webhooks = await lazy(server)
+            print(
+                f"lazy startup: {startup:.2f} s, "
+                f"first send to every channel ({cache} cache): {webhooks:.2f} s"
+            )
+        await server.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
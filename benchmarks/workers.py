@@ -0,0 +1,109 @@
+"""
+Measures IRC fan-out with clients spread over worker processes. The core is a
+Server with a hub but no Discord connection, publishing channel messages the way
+it does for Discord ones, and clients connected through 1, 2 and 4 workers
+(sharing the port with SO_REUSEPORT) count what they receive. Reports how fast
+clients register and join, and messages delivered per second. Run with
+`python -m benchmarks.workers` from the repository root. Workers only add
+throughput when there are cores to run them on.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from iridium.ipc import Hub, RemoteUser
+from iridium.server import BridgeChannel, Server
+from iridium.worker import run_worker
+
+CLIENTS = 200
+MESSAGES = 500
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def client(n, port, joined, messages):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"NICK c{n}\r\nUSER c{n} 0 * :c{n}\r\nJOIN #general\r\n".encode())
+    while b" 366 " not in await reader.readline():
+        pass
+    joined.release()
+    received = 0
+    tail = b""
+    while received < messages:
+        data = tail + await reader.read(65536)
+        received += data.count(b" PRIVMSG ")
+        tail = data[-9:]
+    writer.close()
+
+
+async def run(workers):
+    path = os.path.join(tempfile.mkdtemp(), "bench.sock")
+    port = free_port()
+    config = {"irc": {"bind": "127.0.0.1", "port": port, "ipc_path": path}}
+    server = Server(config)
+    server.loop = asyncio.get_running_loop()
+    server.hub = Hub(
+        path, server.worker_connected, server.worker_event, server.worker_disconnected
+    )
+    await server.hub.start()
+    channel = BridgeChannel("general", server=server, id=1)
+    server.channels[1] = channel
+    server.channel_ids["general"] = 1
+    server.ready = True
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(config,)) for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    while len(server.hub.links) < workers:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+
+    joined = asyncio.Semaphore(0)
+    start = time.perf_counter()
+    clients = [
+        asyncio.create_task(client(n, port, joined, MESSAGES)) for n in range(CLIENTS)
+    ]
+    for _ in range(CLIENTS):
+        await joined.acquire()
+    connect_time = time.perf_counter() - start
+
+    sender = RemoteUser("discord_user", "discord_user", "discord.gg", "Someone")
+    start = time.perf_counter()
+    for n in range(MESSAGES):
+        now = datetime.now(timezone.utc)
+        channel.message(f"message number {n} from discord", sender, now, n)
+        if n % 50 == 0:
+            await asyncio.sleep(0)
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - start
+
+    await server.hub.stop()
+    for process in processes:
+        process.terminate()
+        process.join()
+    os.unlink(path)
+    return CLIENTS / connect_time, CLIENTS * MESSAGES / elapsed
+
+
+def main():
+    print(f"{CLIENTS} clients, {MESSAGES} messages, {os.cpu_count()} cpus")
+    print(f"{'workers':>8} {'clients/s':>10} {'messages/s':>12}")
+    for workers in (1, 2, 4):
+        clients, messages = asyncio.run(run(workers))
+        print(f"{workers:>8} {clients:>10.0f} {messages:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
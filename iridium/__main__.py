@@ -1,10 +1,12 @@
 import argparse
 import asyncio
+import multiprocessing
 import sys
 
 import toml
 
 from .server import Server
+from .worker import run_worker
 
 
 def default_config():
@@ -15,10 +17,22 @@ def default_config():
             "port": 6667,
             "password": "",
             "automap": True,
+            "max_line_length": 512,
+            "sendq_high": 64 * 1024,
+            "sendq_max": 1024 * 1024,
+            "sendq_policy": "",
+            "sendq_backlog": 100,
+            "workers": 0,
+            "ipc_path": "iridium.sock",
         },
         "discord": {
             "token": "",
             "guild_id": 0,
+            "reconfigure_delay": 2.0,
+            "concurrency": 4,
+            "webhook_rate": 5,
+            "webhook_per": 2.0,
+            "presences": False,
         },
         "channels": {
             "general": {
@@ -42,6 +56,26 @@ def default_config():
     }
 
 
+def start_worker(context, config):
+    worker = context.Process(target=run_worker, args=(config,), daemon=True)
+    worker.start()
+    return worker
+
+
+async def supervise(workers, context, config, interval=1.0):
+    # Replaces worker processes that died, so their share of the port is served.
+    while True:
+        await asyncio.sleep(interval)
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                print(
+                    f"Worker {worker.pid} exited ({worker.exitcode}), restarting",
+                    file=sys.stderr,
+                    flush=True,
+                )
+                workers[i] = start_worker(context, config)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -58,16 +92,23 @@ def main():
         )
         return 1
     server = Server(config)
+    # Worker processes serve IRC clients on the same port, see worker.py.
+    context = multiprocessing.get_context("spawn")
+    workers = [start_worker(context, config) for _ in range(server.workers)]
     loop = asyncio.get_event_loop()
+    supervisor = loop.create_task(supervise(workers, context, config))
     try:
         loop.create_task(server.start())
         loop.run_forever()
     except KeyboardInterrupt:
+        supervisor.cancel()
         loop.run_until_complete(server.stop())
         loop.run_until_complete(loop.shutdown_asyncgens())
         # loop.run_until_complete(loop.shutdown_default_executor())
     finally:
         loop.close()
+        for worker in workers:
+            worker.join(timeout=5)
     return 0
 
 
@@ -1,11 +1,11 @@
-import importlib
-import re
+import logging
 import shlex
 from collections import deque
 
 import discord
 
-EMOJI_URL = "https://cdn.discordapp.com/emojis/"
+from .commands import CommandRegistry, Context
+from .render import Renderer
 
 
 def filesize(size, decimal_places=1):
@@ -18,13 +18,6 @@ def filesize(size, decimal_places=1):
     return f"{size:.{decimal_places}f} {unit}"
 
 
-def ircquote(message):
-    author = message.author.name
-    msgtxt = message.clean_content.splitlines()
-    msgtxt = f"{msgtxt[0]}[...]" if len(msgtxt) > 1 else msgtxt[0]
-    return f"<{author}> {msgtxt}"
-
-
 class UserProxy:
     def __init__(self, member):
         self.nickname = member.display_name.replace(" ", "_")
@@ -56,15 +49,20 @@ class BridgeClient(discord.Client):
     def __init__(self, server, **options):
         self.irc = server
         self.guild = None
-        self.commands = self.irc.config.get("commands", {})
+        self.commands = CommandRegistry(
+            self.irc.config.get("commands", {}), context=Context(self.irc)
+        )
         # store ids and authors of messages we send
         # so that reply quotes aren't sent if the quoted
         # message just occurred
         self.msg_id_buffa = deque([], 2)
         self.msg_author_buffa = deque([], 2)
+        self.renderer = Renderer()
         # Make sure we add the members intent, so we can access member information.
         intents = discord.Intents.default()
         intents.members = True
+        # Needed for away-notify, and must be enabled for the bot as well.
+        intents.presences = self.irc.config.get("discord", {}).get("presences", False)
         options["intents"] = intents
         super().__init__(**options)
 
@@ -74,10 +72,10 @@ class BridgeClient(discord.Client):
             msg.id not in self.msg_id_buffa and msg.author not in self.msg_author_buffa
         )
 
-    def named_channel(self, name):
-        for channel in self.guild.text_channels:
-            if channel.name == name:
-                return channel
+    def partial_webhook(self, webhook_id, token):
+        # A webhook that can send messages, built from a cached id and token.
+        data = {"id": webhook_id, "type": 1, "token": token}
+        return discord.Webhook.from_state(data, self._connection)
 
     async def on_ready(self):
         for guild in self.guilds:
@@ -88,113 +86,92 @@ class BridgeClient(discord.Client):
         else:
             print("Unknown guild {}".format(self.irc.config["discord"]["guild_id"]))
 
-    async def on_message(self, message):
+    def relay(self, channel, message, edited=False):
+        source = UserProxy(message.author)
+        # a message is a reply if it has a reference
+        # pins also have references, but they are system type
+        if message.reference is not None and not message.is_system():
+            # check if the original message is cached or
+            # was loaded by the API (and not deleted)
+            original = message.reference.resolved
+            # only send a quote if it wasn't in the last
+            # couple messages.
+            if isinstance(original, discord.Message) and self.is_old(original):
+                channel.message(self.renderer.quote(original), sender=source)
+        # send the message, followed by links to attachments
+        lines = self.renderer.lines(message, edited)
+        if lines:
+            channel.message(
+                "\n".join(lines),
+                sender=source,
+                time=message.edited_at if edited else message.created_at,
+                msgid=message.id,
+            )
+        self.msg_id_buffa.append(message.id)
+        self.msg_author_buffa.append(message.author)
+
+    async def on_message(self, message, edited=False):
         if not message.guild or message.guild != self.guild:
             return
 
         if message.channel.type == discord.ChannelType.text:
-            channel = self.irc.channels.get(message.channel.name)
-            if channel:
-                source = UserProxy(message.author)
-
-                # send text to the IRC channel
-                def send(text):
-                    # replace "<:emoji:biglongidnumber>" with a link to an image
-                    custom_emoji = re.findall(r"(<a?:(\w*):(\d*)>)", text)
-                    for ce in custom_emoji:
-                        text = text.replace(ce[0], f"{EMOJI_URL}{ce[2]}.png")
-                    channel.message(text, sender=source)
-                    self.msg_id_buffa.append(message.id)
-                    self.msg_author_buffa.append(message.author)
-
-                # send a message to the IRC channel
-                def sendmsg(message):
-                    for line in message.clean_content.splitlines():
-                        send(line)
-
-                # a message is a reply if it has a reference
-                # pins also have references, but they are system type
-                is_reply = message.reference is not None
-                is_reply = is_reply and not message.is_system()
-
-                if is_reply:
-                    # check if the original message is cached or
-                    # was loaded by the API
-                    original = message.reference.resolved
-                    if original is not None:
-                        # only send a quote if it wasn't in the last
-                        # couple messages.
-                        if self.is_old(original):
-                            send(ircquote(original))
-                        sendmsg(message)
-                    else:
-                        # did not find original message for reply
-                        # whatever, just send the message
-                        sendmsg(message)
-                else:
-                    # not a reply, send the message
-                    sendmsg(message)
-
-                # send links to attachments
-                for att in message.attachments:
-                    send(f"{att.url} ({att.filename} - {att.size})")
+            channel = self.irc.channels.get(message.channel.id)
+            if channel and channel.sent_by_bridge(message):
+                self.msg_id_buffa.append(message.id)
+                self.msg_author_buffa.append(message.author)
+            elif channel:
+                self.relay(channel, message, edited)
 
             # Potentially log the message.
             await self.irc.log(message)
 
             # Handle chat commands.
-            if message.content.startswith("!") and message.author != self.user:
+            is_command = not edited and message.content.startswith("!")
+            if is_command and message.author != self.user:
                 cmd, *args = shlex.split(message.content[1:])
-                if cmd in self.commands:
-                    options = self.commands[cmd].copy()
-                    module_path = options.pop(
-                        "module", "iridium.commands.{}.handle".format(cmd)
-                    )
-                    mod_name, attr_name = module_path.rsplit(".", 1)
+                command = self.commands.get(cmd)
+                if command:
+                    handler, options = command
                     try:
-                        mod = importlib.import_module(mod_name)
-                        mod = importlib.reload(mod)
-                        handler = getattr(mod, attr_name, None)
-                        if handler:
-                            await handler(message, *args, **options)
-                    except ImportError:
-                        pass
+                        await handler(message, *args, **options)
                     except Exception:
-                        pass
+                        logging.exception('Command "%s" failed', cmd)
 
     async def on_message_edit(self, before, after):
         if before.content != after.content:
-            after.content = f"* {after.content}"
-            await self.on_message(after)
+            await self.on_message(after, edited=True)
 
     async def on_guild_channel_delete(self, channel):
-        await self.irc.reconfigure()
+        if channel.type == discord.ChannelType.text:
+            self.irc.schedule_reconfigure(channel)
 
     async def on_guild_channel_create(self, channel):
-        await self.irc.reconfigure()
+        if channel.type == discord.ChannelType.text:
+            self.irc.schedule_reconfigure(channel)
 
     async def on_guild_channel_update(self, before, after):
-        await self.irc.sync_channels()
+        await self.irc.channel_updated(before, after)
 
     async def on_member_join(self, member):
-        await self.irc.sync_channels()
+        await self.irc.member_joined(member)
 
     async def on_member_remove(self, member):
-        await self.irc.sync_channels()
+        await self.irc.member_removed(member)
 
     async def on_member_update(self, before, after):
         old_nickname = UserProxy(before).nickname
-        new_nickname = UserProxy(after).nickname
-        if old_nickname != new_nickname:
-            for session in self.irc.sessions:
-                if session.authenticated:
-                    session.write("NICK", new_nickname, prefix=old_nickname)
-        await self.irc.sync_channels()
+        user = UserProxy(after)
+        if old_nickname != user.nickname:
+            channels = [
+                c for c in self.irc.channels.values() if before.name in c.members
+            ]
+            self.irc.member_renamed(old_nickname, user, channels)
+        await self.irc.member_updated(before, after)
 
     async def on_reaction_add(self, reaction, member):
         message = reaction.message
         if message.channel.type == discord.ChannelType.text:
-            channel = self.irc.channels.get(message.channel.name)
+            channel = self.irc.channels.get(message.channel.id)
             if channel:
                 source = UserProxy(member)
                 content = reaction.emoji
@@ -204,5 +181,5 @@ class BridgeClient(discord.Client):
                     content = reaction.emoji.url
                 # everyone on IRC must know what the reaction is to!
                 if self.is_old(message):
-                    channel.message(ircquote(message), sender=source)
+                    channel.message(self.renderer.quote(message), sender=source)
                 channel.message(content, sender=source)
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire ttl seconds after they are stored. Concurrent
+    lookups of the same missing key share a single fetch.
+    """
+
+    def __init__(self, ttl, size=256, stats=None, name="cache"):
+        self.ttl = ttl
+        self.size = size
+        self.stats = Counter() if stats is None else stats
+        self.name = name
+        # Key to (expiry time, value), least recently used first.
+        self.entries = OrderedDict()
+        # Key to the task fetching it, while one is running.
+        self.inflight = {}
+
+    @property
+    def hit_rate(self):
+        hits = self.stats[f"{self.name}.hits"] + self.stats[f"{self.name}.shared"]
+        total = hits + self.stats[f"{self.name}.misses"]
+        return hits / total if total else 0.0
+
+    def peek(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def get(self, key, fetch):
+        """
+        Returns the cached value for key, or awaits fetch() to get and store it.
+        """
+        value = self.peek(key)
+        if value is not None:
+            self.stats[f"{self.name}.hits"] += 1
+            return value
+        task = self.inflight.get(key)
+        if task is None:
+            self.stats[f"{self.name}.misses"] += 1
+            task = asyncio.ensure_future(self.load(key, fetch))
+            self.inflight[key] = task
+        else:
+            self.stats[f"{self.name}.shared"] += 1
+        # One caller giving up should not cancel the fetch for the others.
+        return await asyncio.shield(task)
+
+    async def load(self, key, fetch):
+        try:
+            value = await fetch()
+            self.put(key, value)
+            return value
+        finally:
+            del self.inflight[key]
@@ -0,0 +1,114 @@
+import importlib
+import inspect
+import logging
+import os
+
+from ..cache import TTLCache
+
+
+class Context:
+    """
+    Shared resources for command handlers, passed as the context keyword
+    argument to handlers that accept one.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.caches = {}
+
+    @property
+    def http(self):
+        return self.server.http
+
+    def cache(self, name, ttl, size=256):
+        """
+        Returns the named TTLCache, creating it the first time. Caches live here
+        rather than in command modules so they survive reloads.
+        """
+        cache = self.caches.get(name)
+        if cache is None:
+            stats = getattr(self.server, "stats", None)
+            cache = self.caches[name] = TTLCache(ttl, size, stats=stats, name=name)
+        cache.ttl = ttl
+        cache.size = size
+        return cache
+
+
+class Command:
+    def __init__(self, name, options):
+        options = options.copy()
+        module_path = options.pop("module", "iridium.commands.{}.handle".format(name))
+        self.module_name, self.attr_name = module_path.rsplit(".", 1)
+        # Reload the module when its file changes, checked on each invocation.
+        self.watch = options.pop("reload", False)
+        self.options = options
+        self.module = None
+        self.mtime = None
+        self.handler = None
+        self.wants_context = False
+
+    def mtime_changed(self):
+        try:
+            return os.path.getmtime(self.module.__file__) != self.mtime
+        except (OSError, TypeError):
+            return False
+
+    def load(self, reload=False):
+        if self.module is None:
+            self.module = importlib.import_module(self.module_name)
+        elif reload:
+            self.module = importlib.reload(self.module)
+        try:
+            self.mtime = os.path.getmtime(self.module.__file__)
+        except (OSError, TypeError):
+            self.mtime = None
+        self.handler = getattr(self.module, self.attr_name, None)
+        try:
+            self.wants_context = "context" in inspect.signature(self.handler).parameters
+        except (TypeError, ValueError):
+            self.wants_context = False
+
+
+class CommandRegistry:
+    """
+    Resolves the handlers of the commands in the [commands] configuration the
+    first time each is used, and keeps them. Modules are only reloaded by
+    reload() (on SIGHUP), or when a command sets reload = true and its module
+    file has changed since it was loaded.
+    """
+
+    def __init__(self, config, context=None):
+        self.context = context
+        self.commands = {
+            name: Command(name, options) for name, options in config.items()
+        }
+
+    def get(self, name):
+        """
+        Returns the (handler, options) for a command, or None if it is not
+        configured or can't be loaded.
+        """
+        command = self.commands.get(name)
+        if command is None:
+            return None
+        try:
+            if command.handler is None:
+                command.load()
+            elif command.watch and command.mtime_changed():
+                command.load(reload=True)
+        except Exception:
+            logging.exception('Could not load command "%s"', name)
+            return None
+        if command.handler is None:
+            return None
+        if command.wants_context:
+            return command.handler, dict(command.options, context=self.context)
+        return command.handler, command.options
+
+    def reload(self):
+        for name, command in self.commands.items():
+            if command.module is not None:
+                try:
+                    command.load(reload=True)
+                except Exception:
+                    logging.exception('Could not reload command "%s"', name)
@@ -2,19 +2,23 @@ import re
 
 import aiohttp
 
+ENDPOINT = "https://api.github.com/repos/{}/issues"
+
 label_regex = re.compile(r"\[([^\]]+)\]")
 
 
-async def handle(message, *args, user=None, token=None, repo=None, labels=None):
+async def handle(
+    message, *args, user=None, token=None, repo=None, labels=None, context=None
+):
     if not user or not token:
         return
     auth = aiohttp.BasicAuth(user, token)
-    url = f"https://api.github.com/repos/{repo}/issues"
+    url = ENDPOINT.format(repo)
     headers = {
         "Accept": "application/vnd.github.v3+json",
     }
-    if labels is None:
-        labels = []
+    # Copy the configured labels, they are shared between invocations.
+    labels = list(labels or [])
     if len(args) == 2:
         data = {
             "title": args[0],
@@ -29,7 +33,6 @@ async def handle(message, *args, user=None, token=None, repo=None, labels=None):
         }
     if labels:
         data["labels"] = labels
-    async with aiohttp.ClientSession(headers=headers, auth=auth) as session:
-        async with session.post(url, json=data) as resp:
-            issue = await resp.json()
-            await message.reply(issue["html_url"])
+    async with context.http.post(url, json=data, headers=headers, auth=auth) as resp:
+        issue = await resp.json()
+        await message.reply(issue["html_url"])
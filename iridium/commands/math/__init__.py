@@ -1,11 +1,45 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ...webhook import MESSAGE_LIMIT
 from .parser import evaluate
 
+executor = None
+# Evaluations handed to the executor that haven't finished or timed out.
+running = 0
+
+
+def calculate(source, cancelled=None):
+    result = str(evaluate(source, cancelled))
+    if len(result) > MESSAGE_LIMIT:
+        result = result[: MESSAGE_LIMIT - 3] + "..."
+    return result
+
 
-async def handle(message, *args):
+async def handle(message, *args, timeout=2.0, workers=2, queue=8):
+    global executor, running
+    if executor is None:
+        executor = ThreadPoolExecutor(workers, thread_name_prefix="math")
+    if running >= workers + queue:
+        await message.reply("too many calculations, try again later")
+        return
+    loop = asyncio.get_running_loop()
+    cancelled = threading.Event()
+    running += 1
     try:
-        result = str(evaluate("".join(args)))
+        result = await asyncio.wait_for(
+            loop.run_in_executor(executor, calculate, "".join(args), cancelled),
+            timeout,
+        )
         await message.reply(result)
+    except asyncio.TimeoutError:
+        # Stops the evaluation at its next step if it is still running.
+        cancelled.set()
+        await message.reply("took too long")
     except ZeroDivisionError:
         await message.reply("division by zero")
     except Exception as ex:
         await message.reply(str(ex))
+    finally:
+        running -= 1
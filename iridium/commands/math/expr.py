@@ -1,4 +1,13 @@
 import math
+import operator
+from array import array
+from itertools import repeat
+
+# Largest integer, in bits, an expression may produce along the way. Bounds the
+# time and memory of each arithmetic operation.
+MAX_BITS = 4096
+# Most elements a vector may have.
+MAX_LENGTH = 100000
 
 
 class Number(object):
@@ -35,26 +44,176 @@ class NumericalOp(object):
         return self.op(self.expr.eval())
 
 
+class ListOp(object):
+    """covers [a, b, c] and functions like sum that take several arguments"""
+
+    def __init__(self, op, exprs):
+        self.exprs = exprs
+        self.op = op
+
+    def eval(self):
+        return self.op(*[expr.eval() for expr in self.exprs])
+
+
+def vector(*items):
+    """Builds a vector of floats from numbers and other vectors."""
+    result = array("d")
+    for item in items:
+        if isinstance(item, array):
+            result.extend(item)
+        else:
+            result.append(item)
+        if len(result) > MAX_LENGTH:
+            raise Exception("Vector too long.")
+    return result
+
+
+def span(a, b):
+    """Vector of the whole numbers from a to b, inclusive."""
+    if isinstance(a, array) or isinstance(b, array) or a != int(a) or b != int(b):
+        raise Exception("Ranges need whole numbers.")
+    a, b = int(a), int(b)
+    if abs(b - a) >= MAX_LENGTH:
+        raise Exception("Range too long.")
+    return array("d", range(a, b + 1) if a <= b else range(a, b - 1, -1))
+
+
+def each(op):
+    """Wraps a function of one number to apply it to each element of a vector."""
+
+    def apply(a):
+        if isinstance(a, array):
+            return array("d", map(op, a))
+        return op(a)
+
+    return apply
+
+
+def elementwise(op):
+    """
+    Wraps a function of two numbers to apply it to pairs of elements of vectors,
+    or to each element of a vector and a number.
+    """
+
+    def apply(a, b):
+        if isinstance(a, array):
+            if isinstance(b, array):
+                if len(a) != len(b):
+                    raise Exception("Vectors have different lengths.")
+                return array("d", map(op, a, b))
+            return array("d", map(op, a, repeat(b)))
+        if isinstance(b, array):
+            return array("d", map(op, repeat(a), b))
+        return op(a, b)
+
+    return apply
+
+
+def aggregate(op):
+    """Wraps a function of a vector to take any mix of numbers and vectors."""
+
+    def apply(*items):
+        return op(vector(*items))
+
+    return apply
+
+
+def mean(values):
+    if not values:
+        raise Exception("Mean of nothing.")
+    return math.fsum(values) / len(values)
+
+
+def stdev(values):
+    """Sample standard deviation."""
+    if len(values) < 2:
+        raise Exception("Standard deviation needs at least two values.")
+    deviations = array("d", map(operator.sub, values, repeat(mean(values))))
+    squares = math.fsum(map(operator.mul, deviations, deviations))
+    return math.sqrt(squares / (len(values) - 1))
+
+
 def smartdiv(a, b):
     return float(a) / b
 
 
 def smartpow(a, b):
-    if b > 100:
-        raise Exception("Exponent too large.")
-    else:
-        return a**b
+    if isinstance(a, int) and isinstance(b, int) and abs(a) > 1:
+        if b > MAX_BITS or (a.bit_length() - 1) * b > MAX_BITS:
+            raise Exception("Exponent too large.")
+    return a**b
 
 
 def log2(n):
     return math.log(n) / math.log(2)
 
 
-def eval(expr):
-    n = expr.eval()
+def simplify(n):
+    if isinstance(n, array):
+        return [simplify(x) for x in n]
     try:
         if round(n) == n:
             return int(n)
     except OverflowError:
         pass
     return n
+
+
+def children(node):
+    if isinstance(node, InfixOp):
+        return (node.expr1, node.expr2)
+    if isinstance(node, NumericalOp):
+        return (node.expr,)
+    return node.exprs
+
+
+def compile(tree):
+    """
+    Flattens an expression tree into a postfix program of (arity, value)
+    instructions: arity 0 pushes value, others apply value to that many operands
+    popped off the stack. Walks the tree without recursion, so deeply nested
+    expressions don't hit the recursion limit.
+    """
+    program = []
+    pending = [(tree, False)]
+    while pending:
+        node, ready = pending.pop()
+        if isinstance(node, Number):
+            program.append((0, node.num))
+        elif ready:
+            program.append((len(children(node)), node.op))
+        else:
+            pending.append((node, True))
+            pending.extend((child, False) for child in reversed(children(node)))
+    return tuple(program)
+
+
+def run(program, cancelled=None):
+    """
+    Runs a compiled program, giving up when an integer grows past MAX_BITS or
+    the cancelled event (a threading.Event) is set.
+    """
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    for arity, value in program:
+        if cancelled is not None and cancelled.is_set():
+            raise Exception("Cancelled.")
+        if arity == 0:
+            push(value)
+            continue
+        if arity == 1:
+            result = value(stack[-1])
+        elif arity == 2:
+            b = pop()
+            result = value(stack[-1], b)
+        else:
+            args = stack[-arity:]
+            # Keep one slot for the result.
+            keep = len(stack) - arity + 1
+            del stack[keep:]
+            result = value(*args)
+        if isinstance(result, int) and result.bit_length() > MAX_BITS:
+            raise Exception("Number too large.")
+        stack[-1] = result
+    return stack[0]
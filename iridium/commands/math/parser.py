@@ -1,146 +1,218 @@
 # flake8: noqa
-tokens = ("NAME", "INT", "FLOAT", "TIMES", "POW", "PLUS", "MINUS", "DIV")
-
-literals = ["(", ")"]
-
-t_TIMES = r"\*"
-t_POW = r"\*\*"
-t_PLUS = r"\+"
-t_MINUS = r"-"
-t_DIV = r"/"
-
-precedence = (
-    ("left", "PLUS", "MINUS"),
-    ("left", "TIMES", "DIV"),
-    ("right", "POW"),
-    ("right", "UMINUS"),
-)
-
-
-def t_FLOAT(t):
-    r"([0-9]+\.[0-9]*)|([0-9]*\.[0-9]+)"
-    try:
-        t.value = float(t.value)
-    except ValueError:
-        raise Exception("Float value too large %s" % t.value)
-        t.value = 0
-    return t
-
-
-def t_INT(t):
-    r"[0-9]+"
-    try:
-        t.value = int(t.value)
-    except ValueError:
-        raise Exception("Integer value too large %s" % t.value)
-        t.value = 0
-    return t
-
-
-t_NAME = r"[a-zA-Z_][a-zA-Z0-9_]*"
-t_ignore = " \t"
-
-
-def t_newline(t):
-    r"\n+"
-    t.lexer.lineno += t.value.count("\n")
-
-
-def t_error(t):
-    raise Exception("Illegal character '%s'" % t.value[0])
-    t.lexer.skip(1)
-
-
-import ply.lex as lex
-
-lex.lex(debug=False)
-
-from .expr import *
-
-
-def p_expression_float(p):
-    "expression : FLOAT"
-    p[0] = Number(p[1])
-
-
-def p_expression_int(p):
-    "expression : INT"
-    p[0] = Number(p[1])
-
-
+import math
 import operator
+import threading
+from collections import OrderedDict
 
-
-def p_expression_add(p):
-    "expression : expression PLUS expression"
-    p[0] = InfixOp(operator.add, p[1], p[3])
-
-
-def p_expression_sub(p):
-    "expression : expression MINUS expression"
-    p[0] = InfixOp(operator.sub, p[1], p[3])
-
-
-def p_expression_mult(p):
-    "expression : expression TIMES expression"
-    p[0] = InfixOp(operator.mul, p[1], p[3])
-
-
-def p_expression_pow(p):
-    "expression : expression POW expression"
-    p[0] = InfixOp(smartpow, p[1], p[3])
-
-
-def p_expression_uminus(p):
-    "expression : MINUS expression %prec UMINUS"
-    p[0] = NumericalOp(operator.neg, p[2])
-
-
-def p_expression_div(p):
-    "expression : expression DIV expression"
-    p[0] = InfixOp(smartdiv, p[1], p[3])
-
-
-def p_expression_function(p):
-    "expression : NAME '(' expression ')'"
-    try:
-        op = {
-            "sin": math.sin,
-            "asin": math.asin,
-            "cos": math.cos,
-            "acos": math.acos,
-            "tan": math.tan,
-            "atan": math.atan,
-            "abs": abs,
-            "log": math.log,
-            "int": int,
-            "float": float,
-            "floor": math.floor,
-            "ceil": math.ceil,
-            "exp": math.exp,
-            "log2": log2,
-            "log10": math.log10,
-            "sqrt": math.sqrt,
-        }[p[1]]
-        p[0] = NumericalOp(op, p[3])
-    except KeyError as ex:
-        raise Exception("Unsupported function: %s" % ex)
-
-
-def p_expression_group(p):
-    "expression : '(' expression ')'"
-    p[0] = p[2]
-
-
-def p_error(p):
-    raise Exception("Syntax error")
-
-
+import ply.lex as lex
 import ply.yacc as yacc
 
-yacc.yacc(debug=False, write_tables=False)
-
+from .expr import (
+    InfixOp,
+    ListOp,
+    Number,
+    NumericalOp,
+    aggregate,
+    compile,
+    each,
+    elementwise,
+    log2,
+    mean,
+    run,
+    simplify,
+    smartdiv,
+    smartpow,
+    span,
+    stdev,
+    vector,
+)
 
-def evaluate(s):
-    e = yacc.parse(s)
-    return eval(e)
+FUNCTIONS = {
+    name: each(func)
+    for name, func in {
+        "sin": math.sin,
+        "asin": math.asin,
+        "cos": math.cos,
+        "acos": math.acos,
+        "tan": math.tan,
+        "atan": math.atan,
+        "abs": abs,
+        "log": math.log,
+        "int": int,
+        "float": float,
+        "floor": math.floor,
+        "ceil": math.ceil,
+        "exp": math.exp,
+        "log2": log2,
+        "log10": math.log10,
+        "sqrt": math.sqrt,
+    }.items()
+}
+
+AGGREGATES = {
+    "sum": aggregate(math.fsum),
+    "mean": aggregate(mean),
+    "stdev": aggregate(stdev),
+    "min": aggregate(min),
+    "max": aggregate(max),
+}
+
+add = elementwise(operator.add)
+sub = elementwise(operator.sub)
+mul = elementwise(operator.mul)
+div = elementwise(smartdiv)
+power = elementwise(smartpow)
+neg = each(operator.neg)
+
+
+class Grammar:
+    tokens = ("NAME", "INT", "FLOAT", "TIMES", "POW", "PLUS", "MINUS", "DIV", "RANGE")
+
+    literals = ["(", ")", "[", "]", ","]
+
+    t_TIMES = r"\*"
+    t_POW = r"\*\*"
+    t_PLUS = r"\+"
+    t_MINUS = r"-"
+    t_DIV = r"/"
+    t_RANGE = r"\.\."
+
+    precedence = (
+        ("nonassoc", "RANGE"),
+        ("left", "PLUS", "MINUS"),
+        ("left", "TIMES", "DIV"),
+        ("right", "POW"),
+        ("right", "UMINUS"),
+    )
+
+    def t_FLOAT(self, t):
+        r"([0-9]+\.(?!\.)[0-9]*)|([0-9]*\.[0-9]+)"
+        try:
+            t.value = float(t.value)
+        except ValueError:
+            raise Exception("Float value too large %s" % t.value)
+        return t
+
+    def t_INT(self, t):
+        r"[0-9]+"
+        try:
+            t.value = int(t.value)
+        except ValueError:
+            raise Exception("Integer value too large %s" % t.value)
+        return t
+
+    t_NAME = r"[a-zA-Z_][a-zA-Z0-9_]*"
+    t_ignore = " \t"
+
+    def t_newline(self, t):
+        r"\n+"
+        t.lexer.lineno += t.value.count("\n")
+
+    def t_error(self, t):
+        raise Exception("Illegal character '%s'" % t.value[0])
+
+    def p_expression_float(self, p):
+        "expression : FLOAT"
+        p[0] = Number(p[1])
+
+    def p_expression_int(self, p):
+        "expression : INT"
+        p[0] = Number(p[1])
+
+    def p_expression_add(self, p):
+        "expression : expression PLUS expression"
+        p[0] = InfixOp(add, p[1], p[3])
+
+    def p_expression_sub(self, p):
+        "expression : expression MINUS expression"
+        p[0] = InfixOp(sub, p[1], p[3])
+
+    def p_expression_mult(self, p):
+        "expression : expression TIMES expression"
+        p[0] = InfixOp(mul, p[1], p[3])
+
+    def p_expression_pow(self, p):
+        "expression : expression POW expression"
+        p[0] = InfixOp(power, p[1], p[3])
+
+    def p_expression_uminus(self, p):
+        "expression : MINUS expression %prec UMINUS"
+        p[0] = NumericalOp(neg, p[2])
+
+    def p_expression_div(self, p):
+        "expression : expression DIV expression"
+        p[0] = InfixOp(div, p[1], p[3])
+
+    def p_expression_range(self, p):
+        "expression : expression RANGE expression"
+        p[0] = InfixOp(span, p[1], p[3])
+
+    def p_expression_vector(self, p):
+        "expression : '[' items ']'"
+        p[0] = ListOp(vector, p[2])
+
+    def p_expression_function(self, p):
+        "expression : NAME '(' items ')'"
+        name, args = p[1], p[3]
+        if name in AGGREGATES:
+            p[0] = ListOp(AGGREGATES[name], args)
+        elif name not in FUNCTIONS:
+            raise Exception("Unsupported function: '%s'" % name)
+        elif len(args) > 1:
+            raise Exception("%s takes one argument" % name)
+        else:
+            p[0] = NumericalOp(FUNCTIONS[name], args[0])
+
+    def p_expression_group(self, p):
+        "expression : '(' expression ')'"
+        p[0] = p[2]
+
+    def p_items_one(self, p):
+        "items : expression"
+        p[0] = [p[1]]
+
+    def p_items_more(self, p):
+        "items : items ',' expression"
+        p[0] = p[1]
+        p[0].append(p[3])
+
+    def p_error(self, p):
+        raise Exception("Syntax error")
+
+
+class Engine:
+    """
+    Builds the lexer and parser tables once, compiles expressions into flat
+    stack programs (see expr.compile) and keeps the most recently used ones.
+    """
+
+    def __init__(self, cache_size=256):
+        grammar = Grammar()
+        self.lexer = lex.lex(module=grammar, debug=False)
+        self.parser = yacc.yacc(module=grammar, debug=False, write_tables=False)
+        self.cache_size = cache_size
+        self.programs = OrderedDict()
+        # PLY keeps parsing state on the lexer and parser objects.
+        self.lock = threading.Lock()
+
+    def compile(self, source):
+        with self.lock:
+            program = self.programs.get(source)
+            if program is not None:
+                self.programs.move_to_end(source)
+                return program
+            program = compile(self.parser.parse(source, lexer=self.lexer))
+            self.programs[source] = program
+            while len(self.programs) > self.cache_size:
+                self.programs.popitem(last=False)
+            return program
+
+    def evaluate(self, source, cancelled=None):
+        return simplify(run(self.compile(source), cancelled))
+
+
+engine = Engine()
+
+
+def evaluate(s, cancelled=None):
+    return engine.evaluate(s, cancelled)
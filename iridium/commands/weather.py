@@ -1,4 +1,5 @@
-import aiohttp
+import asyncio
+import logging
 
 ENDPOINT = "http://api.openweathermap.org/data/2.5/weather"
 AQI_ENDPOINT = "https://www.airnowapi.org/aq/observation/latLong/current/"
@@ -21,51 +22,95 @@ def get_aqi(data):
     return "AQI = {} [{}] - {}".format(max_aqi, pollutant, condition)
 
 
-async def handle(message, *args, appid=None, airnow=None):
+async def fetch_json(session, url, params):
+    async with session.get(url, params=params) as resp:
+        # Only successful responses should end up cached.
+        resp.raise_for_status()
+        return await resp.json()
+
+
+def location(args):
+    if len(args) == 1 and args[0].isdigit():
+        return ("zip", args[0])
+    return ("q", " ".join(" ".join(args).lower().split()))
+
+
+async def handle(
+    message,
+    *args,
+    appid=None,
+    airnow=None,
+    ttl=600,
+    aqi_ttl=3600,
+    cache_size=256,
+    context=None,
+):
     if not appid:
         return
 
-    params = {
-        "units": "imperial",
-        "appid": appid,
-    }
-    if len(args) == 1 and args[0].isdigit():
-        params["zip"] = args[0]
-    else:
-        params["q"] = " ".join(args)
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(ENDPOINT, params=params) as resp:
-            data = await resp.json()
-
-            unit = "F"
-            temp = data["main"]["temp"]
-            feels_like = data["main"]["feels_like"]
-
-            if data["sys"]["country"] not in ["US", "MM", "LR"]:
-                unit = "C"
-                temp = to_c(temp)
-                feels_like = to_c(feels_like)
-
-            weather = "Currently in {}: {:.2f}°{} (feels like {:.2f}°{}) and {}".format(
-                data["name"],
-                temp,
-                unit,
-                feels_like,
-                unit,
-                data["weather"][0]["description"],
-            )
+    key = location(args)
+    weather_cache = context.cache("weather", ttl, cache_size)
+    aqi_cache = context.cache("weather.aqi", aqi_ttl, cache_size)
+    # Coordinates of each location, from earlier weather responses.
+    coords_cache = context.cache("weather.coords", 86400, cache_size)
+
+    def get_weather():
+        params = {
+            "units": "imperial",
+            "appid": appid,
+            key[0]: key[1],
+        }
+        return weather_cache.get(
+            key, lambda: fetch_json(context.http, ENDPOINT, params)
+        )
 
+    def get_air_quality(coords):
+        params = {
+            "format": "application/json",
+            "latitude": coords[0],
+            "longitude": coords[1],
+            "API_KEY": airnow,
+        }
+        return aqi_cache.get(
+            coords, lambda: fetch_json(context.http, AQI_ENDPOINT, params)
+        )
+
+    coords = coords_cache.peek(key)
+    aqi_data = None
+    if airnow and coords:
+        # No need to wait for the weather to know where to ask about air quality.
+        data, aqi_data = await asyncio.gather(get_weather(), get_air_quality(coords))
+    else:
+        data = await get_weather()
+        coords = (round(data["coord"]["lat"], 2), round(data["coord"]["lon"], 2))
+        coords_cache.put(key, coords)
         if airnow:
-            params = {
-                "format": "application/json",
-                "latitude": data["coord"]["lat"],
-                "longitude": data["coord"]["lon"],
-                "API_KEY": airnow,
-            }
-            async with session.get(AQI_ENDPOINT, params=params) as resp:
-                aqi_data = await resp.json()
-                if aqi_data:
-                    weather += " ({})".format(get_aqi(aqi_data))
-
-        await message.reply(weather)
+            aqi_data = await get_air_quality(coords)
+
+    unit = "F"
+    temp = data["main"]["temp"]
+    feels_like = data["main"]["feels_like"]
+
+    if data["sys"]["country"] not in ["US", "MM", "LR"]:
+        unit = "C"
+        temp = to_c(temp)
+        feels_like = to_c(feels_like)
+
+    weather = "Currently in {}: {:.2f}°{} (feels like {:.2f}°{}) and {}".format(
+        data["name"],
+        temp,
+        unit,
+        feels_like,
+        unit,
+        data["weather"][0]["description"],
+    )
+
+    if aqi_data:
+        weather += " ({})".format(get_aqi(aqi_data))
+
+    logging.debug(
+        "weather cache hit rate %.2f, air quality %.2f",
+        weather_cache.hit_rate,
+        aqi_cache.hit_rate,
+    )
+    await message.reply(weather)
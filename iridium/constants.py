@@ -9,6 +9,8 @@ class RPL(enum.Enum):
     CREATED = 3
     MYINFO = 4
     BOUNCE = 5
+    # https://modern.ircdocs.horse/#rplisupport-005
+    ISUPPORT = 5
     USERHOST = 302
     ISON = 303
     AWAY = 301
@@ -158,6 +160,10 @@ class ERR(enum.Enum):
     SASLTOOLONG = 905
     SASLABORTED = 906
     SASLALREADY = 907
+    # https://ircv3.net/specs/extensions/message-tags
+    INPUTTOOLONG = 417
+    # https://ircv3.net/specs/extensions/capability-negotiation
+    INVALIDCAPCMD = 410
 
     def __str__(self):
         return "{:03d}".format(self.value)
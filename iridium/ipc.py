@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import marshal
+import struct
+
+# Events are tuples of strings, numbers, lists and tuples, sent as marshal data
+# after its length.
+HEADER = struct.Struct("!I")
+
+
+def pack(event):
+    data = marshal.dumps(event)
+    return HEADER.pack(len(data)) + data
+
+
+async def read_events(reader, handler):
+    # Calls handler with each event until the other end goes away.
+    try:
+        while True:
+            header = await reader.readexactly(HEADER.size)
+            (length,) = HEADER.unpack(header)
+            event = marshal.loads(await reader.readexactly(length))
+            try:
+                handler(event)
+            except Exception:
+                logging.exception("Error handling event %s", event[0])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+
+class RemoteUser:
+    """
+    A user known only from events: a Discord member, or an IRC session in
+    another process. Messages to it are delivered through link, if it has one.
+    """
+
+    def __init__(self, nickname, username, hostname, realname, link=None):
+        self.nickname = nickname
+        self.username = username
+        self.hostname = hostname
+        self.realname = realname
+        self.link = link
+        self.channels = set()
+
+    def __str__(self):
+        return f"{self.nickname}!{self.username}@{self.hostname}"
+
+    @classmethod
+    def of(cls, user):
+        return (user.nickname, user.username, user.hostname, user.realname)
+
+    def message(self, content, sender=None):
+        if self.link:
+            self.link.send(("dm", self.nickname, RemoteUser.of(sender), content))
+
+
+class Link:
+    """
+    One end of the Unix socket between the core process and a worker.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def send(self, event):
+        self.send_packed(pack(event))
+
+    def send_packed(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    async def run(self, handler):
+        await read_events(self.reader, handler)
+        self.writer.close()
+
+
+class Hub:
+    """
+    The core process's end of the IPC channel: accepts worker connections and
+    publishes events to them, packing each event once for all of them.
+    """
+
+    def __init__(self, path, connected, event, disconnected):
+        self.path = path
+        self.links = []
+        self.server = None
+        # Callbacks for a new link, an event from a link, and a lost link.
+        self.connected = connected
+        self.event = event
+        self.disconnected = disconnected
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.accept, path=self.path)
+
+    async def stop(self):
+        self.server.close()
+        for link in self.links:
+            link.writer.close()
+            link.reader.feed_eof()
+        # Let each accept finish, which calls disconnected.
+        while self.links:
+            await asyncio.sleep(0)
+        await self.server.wait_closed()
+
+    async def accept(self, reader, writer):
+        link = Link(reader, writer)
+        self.links.append(link)
+        self.connected(link)
+        try:
+            await link.run(lambda event: self.event(link, event))
+        finally:
+            self.links.remove(link)
+            self.disconnected(link)
+
+    def publish(self, event, skip=None):
+        data = pack(event)
+        for link in self.links:
+            if link is not skip:
+                link.send_packed(data)
+
+
+async def connect(path, delay=0.1, max_delay=2.0):
+    # Workers may start long before the core is listening, for instance while
+    # it migrates a large message log, so keep trying until it is.
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+            return Link(reader, writer)
+        except (FileNotFoundError, ConnectionRefusedError):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
@@ -1,5 +1,10 @@
 import asyncio
+import itertools
 import logging
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
 
 from .constants import ERR, RPL
 
@@ -11,6 +16,151 @@ def escape(text):
     return text
 
 
+# RFC 1459 casemapping, where []\\~ are the uppercase forms of {}|^
+CASEMAP = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~", "abcdefghijklmnopqrstuvwxyz{}|^"
+)
+
+
+def casefold(nick):
+    return nick.translate(CASEMAP)
+
+
+def mask_pattern(mask):
+    # In IRC masks, * matches any run of characters and ? any one character.
+    pattern = re.escape(casefold(mask)).replace(r"\*", ".*").replace(r"\?", ".")
+    return re.compile(pattern)
+
+
+def parse_timestamp(value):
+    # IRCv3 timestamps look like 2021-01-02T03:04:05.678Z
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+
+
+def format_time(value):
+    # Takes a datetime (naive ones are UTC, as discord.py gives them) or a
+    # timestamp, and formats it for the server-time time tag.
+    if not isinstance(value, datetime):
+        value = datetime.fromtimestamp(value, timezone.utc)
+    elif value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def timestamp(value):
+    # Seconds since the epoch of a datetime (naive ones are UTC) or timestamp.
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def format_action(content):
+    # Turns a CTCP ACTION ("\x01ACTION text\x01") into _text_ for Discord.
+    if content.startswith("\x01ACTION ") and content.endswith("\x01"):
+        return f"_{content[8:-1]}_"
+    return content
+
+
+# Longest line, including the line ending but not message tags.
+MAX_LINE = 512
+# Commands whose text is split over as many lines as it takes.
+SPLIT_COMMANDS = {"PRIVMSG", "NOTICE"}
+# Bytes left for the client's nickname in replies encoded for any client.
+NICK_ROOM = 64
+# Features announced with RPL_ISUPPORT after RPL_WELCOME. ELIST filters are
+# masks, negated masks, topic age and user counts, see Server.list_lines.
+ISUPPORT = (
+    "CASEMAPPING=rfc1459",
+    "CHANTYPES=#",
+    "ELIST=MNTU",
+    f"NICKLEN={NICK_ROOM}",
+    "SAFELIST",
+)
+
+# https://ircv3.net/specs/extensions/multiline
+MULTILINE_MAX_BYTES = 4096
+MULTILINE_MAX_LINES = 100
+# Capabilities offered with CAP LS, and their values.
+CAPABILITIES = {
+    "away-notify": None,
+    "batch": None,
+    "draft/chathistory": None,
+    "draft/multiline": "max-bytes={},max-lines={}".format(
+        MULTILINE_MAX_BYTES, MULTILINE_MAX_LINES
+    ),
+    "echo-message": None,
+    "message-tags": None,
+    "server-time": None,
+}
+# Capabilities that change how a PRIVMSG is encoded, see encode_message.
+MESSAGE_CAPS = frozenset(("draft/multiline", "message-tags", "server-time"))
+# Capabilities that let the client send tags.
+TAG_CAPS = frozenset(("draft/multiline", "message-tags"))
+# Clients may send up to this many bytes of tags on top of MAX_LINE.
+MAX_TAGS = 4096
+
+batch_ids = itertools.count(1)
+
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def unescape_tag(value):
+    # https://ircv3.net/specs/extensions/message-tags#escaping-values
+    chars = []
+    escaped = False
+    for c in value:
+        if escaped:
+            chars.append(TAG_ESCAPES.get(c, c))
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        else:
+            chars.append(c)
+    return "".join(chars)
+
+
+def parse_tags(text):
+    tags = {}
+    for tag in text.split(";"):
+        key, _, value = tag.partition("=")
+        tags[key] = unescape_tag(value) if "\\" in value else value
+    return tags
+
+
+def split_lines(text):
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.split("\n")
+
+
+def split_text(text, width):
+    """
+    Splits text into UTF-8 chunks of at most width bytes, with each line of the
+    text starting a new chunk. Long lines are broken after a space where one is
+    close enough to the limit, and never inside a character, so concatenating
+    the chunks of a line gives back the line.
+    """
+    width = max(width, 16)
+    chunks = []
+    for line in split_lines(text):
+        data = line.encode("utf-8")
+        while len(data) > width:
+            cut = width
+            # Back up to the first byte of a character (not 0b10xxxxxx).
+            while data[cut] & 0xC0 == 0x80:
+                cut -= 1
+            space = data.rfind(b" ", 0, cut)
+            if space >= width // 2:
+                cut = space + 1
+            chunks.append(data[:cut])
+            data = data[cut:]
+        if data:
+            chunks.append(data)
+    return chunks or [b""]
+
+
 def try_decode(text, default=None):
     try:
         return text.decode("utf-8")
@@ -22,6 +172,166 @@ def try_decode(text, default=None):
     return default
 
 
+def encode(code, *params, prefix, room=0):
+    """
+    Encodes a line with a prefix. Line breaks in the parameters become spaces,
+    except in the text of SPLIT_COMMANDS, which goes out as one line for each
+    of its lines. A last parameter too long to fit in MAX_LINE less room bytes
+    is split over more lines for SPLIT_COMMANDS, and cut short otherwise.
+    """
+    if not params:
+        return ":{} {}\r\n".format(prefix, code).encode("utf-8")
+    *first, last = [str(p) for p in params]
+    joined = " ".join(first) + (" " if first else "")
+    if "\r" in joined or "\n" in joined:
+        joined = " ".join(split_lines(joined))
+    split = code in SPLIT_COMMANDS
+    breaks = "\n" in last or "\r" in last
+    if breaks and not split:
+        last = " ".join(split_lines(last))
+    data = ":{} {} {}:{}\r\n".format(prefix, code, joined, last).encode("utf-8")
+    if len(data) > MAX_LINE - room or (breaks and split):
+        head = ":{} {} {}:".format(prefix, code, joined).encode("utf-8")
+        chunks = split_text(last, MAX_LINE - room - len(head) - 2)
+        if not split:
+            del chunks[1:]
+        return b"".join(head + chunk + b"\r\n" for chunk in chunks)
+    return data
+
+
+def encode_reply(code, *params, prefix, room=NICK_ROOM):
+    # Encodes a numeric reply for any client whose nickname is up to room bytes
+    # long: the part after its nickname, see IRCSession.send_reply. The "*"
+    # stands in for one byte of the nickname.
+    start = len(":{} {} *".format(prefix, code).encode("utf-8"))
+    return encode(code, "*", *params, prefix=prefix, room=room - 1)[start:]
+
+
+def encode_list_reply(code, *params, items, prefix, room=NICK_ROOM):
+    """
+    Encodes a numeric reply whose last parameter is a space separated list of
+    items, over as many lines as it takes for each to fit in MAX_LINE when sent
+    to a client whose nickname is up to room bytes long.
+    """
+    fixed = len(":{} {} ".format(prefix, code).encode("utf-8")) + room
+    width = MAX_LINE - fixed - len(encode_reply(code, *params, "", prefix=prefix))
+    lines = []
+    line = []
+    size = -1
+    for item in items:
+        length = len(item.encode("utf-8")) + 1
+        if line and size + length > width:
+            lines.append(
+                encode_reply(code, *params, " ".join(line), prefix=prefix, room=room)
+            )
+            line = []
+            size = -1
+        line.append(item)
+        size += length
+    if line or not lines:
+        lines.append(
+            encode_reply(code, *params, " ".join(line), prefix=prefix, room=room)
+        )
+    return lines
+
+
+def tag_lines(data, tags):
+    # Adds the same tags (formatted, without the @) to each encoded line.
+    tags = b"@" + tags.encode("utf-8") + b" "
+    return b"".join(tags + line + b"\r\n" for line in data.split(b"\r\n")[:-1])
+
+
+def encode_multiline(target, text, prefix, tags=""):
+    """
+    Encodes a PRIVMSG of any number of lines as a draft/multiline batch, with
+    tags for the whole message on the BATCH line. Lines too long for one message
+    are split and marked to be joined back together.
+    """
+    ref = str(next(batch_ids))
+    head = ":{} PRIVMSG {} :".format(prefix, target).encode("utf-8")
+    width = MAX_LINE - len(head) - 2
+    start = ":{} BATCH +{} draft/multiline {}\r\n".format(prefix, ref, target)
+    if tags:
+        start = "@{} {}".format(tags, start)
+    parts = [start.encode("utf-8")]
+    tag = "@batch={} ".format(ref).encode("utf-8")
+    concat = "@batch={};draft/multiline-concat ".format(ref).encode("utf-8")
+    for line in split_lines(text):
+        for i, chunk in enumerate(split_text(line, width)):
+            parts.append((concat if i else tag) + head + chunk + b"\r\n")
+    parts.append(":{} BATCH -{}\r\n".format(prefix, ref).encode("utf-8"))
+    return b"".join(parts)
+
+
+def encode_message(target, text, prefix, caps=frozenset(), time=None, msgid=None):
+    """
+    Encodes a PRIVMSG for a client with the given capabilities: tagged with the
+    time and id of the message for server-time and message-tags, and as a batch
+    when it has more than one line and the client has draft/multiline.
+    """
+    tags = []
+    if time is not None and "server-time" in caps:
+        tags.append("time=" + format_time(time))
+    if msgid is not None and "message-tags" in caps:
+        tags.append(f"msgid={msgid}")
+    tags = ";".join(tags)
+    data = encode("PRIVMSG", target, text, prefix=prefix)
+    if "draft/multiline" in caps and data.count(b"\n") > 1:
+        return encode_multiline(target, text, prefix, tags)
+    return tag_lines(data, tags) if tags else data
+
+
+class LineFramer:
+    def __init__(self, max_length=512):
+        self.max_length = max_length
+        self.buffer = bytearray()
+        # How much of the buffer has already been searched for a line ending.
+        self.scanned = 0
+        self.discarding = False
+
+    def feed(self, data):
+        """
+        Returns the complete lines in the buffer after appending data, without
+        their line endings. Lines longer than max_length (including the line
+        ending) are returned as None.
+        """
+        buffer = self.buffer
+        if not buffer and data.endswith(b"\n"):
+            # Whole lines with nothing left over from before, the usual case.
+            text = data
+        else:
+            buffer += data
+            end = buffer.rfind(b"\n", self.scanned) + 1
+            if not end:
+                if len(buffer) >= self.max_length:
+                    # No line ending within the limit, so drop it all until the
+                    # next one.
+                    self.discarding = True
+                    buffer.clear()
+                self.scanned = len(buffer)
+                return []
+            # Only the complete lines are copied out, the partial tail stays put.
+            text = bytes(buffer[:end])
+            # Deleting from the front of a bytearray does not move the tail.
+            del buffer[:end]
+            self.scanned = len(buffer)
+        # CRLF, LF and a bare CR all end a line, as in most servers.
+        lines = text.splitlines()
+        # Lines of up to max_length - 2 bytes fit with any line ending, so the
+        # endings only need to be measured when some line is longer.
+        limit = self.max_length - 2
+        if len(text) > limit and max(map(len, lines)) > limit:
+            lines = [
+                None if len(line) > self.max_length else line.rstrip(b"\r\n")
+                for line in text.splitlines(keepends=True)
+            ]
+        if self.discarding:
+            # The first line is the end of one that was already too long.
+            self.discarding = False
+            lines[0] = None
+        return lines
+
+
 UNAUTH_COMMANDS = set(
     [
         "PING",
@@ -34,13 +344,33 @@ UNAUTH_COMMANDS = set(
 )
 
 
+def dispatch_table(cls):
+    """
+    Builds the command table for an IRCSession class from its handle_* methods,
+    recording whether each handler is a coroutine and whether it may be used
+    before registration.
+    """
+    cls.commands = {}
+    for name in dir(cls):
+        if name.startswith("handle_"):
+            handler = getattr(cls, name)
+            cmd = name[7:]
+            cls.commands[cmd] = (
+                handler,
+                asyncio.iscoroutinefunction(handler),
+                cmd in UNAUTH_COMMANDS,
+            )
+    return cls
+
+
+@dispatch_table
 class IRCSession(asyncio.Protocol):
     def __init__(self, server):
         self.server = server
         self.transport = None
         self.address = None
         self.port = None
-        self.buffer = b""
+        self.framer = LineFramer(getattr(server, "max_line_length", 512))
         self.username = ""
         self.nickname = ""
         self.realname = ""
@@ -48,6 +378,28 @@ class IRCSession(asyncio.Protocol):
         self.password = None
         self.authenticated = False
         self.quit_reason = "Quit"
+        # Capabilities the client has enabled, and whether registration is held
+        # until it sends CAP END.
+        self.caps = set()
+        self.negotiating = False
+        # The enabled capabilities that change how messages are encoded, used to
+        # share the encoding between clients with the same ones.
+        self.message_caps = frozenset()
+        self.away = None
+        # BridgeChannels this session has joined.
+        self.channels = set()
+        # Open draft/multiline batches: reference to (target, [(concat, text)]).
+        self.batches = {}
+        # Commands waiting on an async handler that is still running.
+        self.pending = deque()
+        self.worker = None
+        # Output flow control, see pause_writing and resume_writing.
+        self.paused = False
+        self.sendq_high = getattr(server, "sendq_high", 64 * 1024)
+        self.sendq_max = getattr(server, "sendq_max", 1024 * 1024)
+        self.sendq_policy = getattr(server, "sendq_policy", None)
+        self.backlog = deque(maxlen=getattr(server, "sendq_backlog", 100))
+        self.dropped = 0
 
     def __str__(self):
         return f"{self.nickname}!{self.username}@{self.hostname}"
@@ -56,20 +408,40 @@ class IRCSession(asyncio.Protocol):
         self.transport = transport
         self.address, self.port = transport.get_extra_info("peername")
         self.hostname = self.address
+        transport.set_write_buffer_limits(high=self.sendq_high)
         if hasattr(self.server, "connected"):
             asyncio.create_task(self.server.connected(self))
 
     def connection_lost(self, exc):
+        if self.worker:
+            self.worker.cancel()
         if hasattr(self.server, "disconnected"):
             asyncio.create_task(self.server.disconnected(self))
 
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        if self.backlog:
+            data = b"".join(self.backlog)
+            self.backlog.clear()
+            self.send(data)
+
     def data_received(self, data):
-        self.buffer += data
-        *lines, self.buffer = self.buffer.split(b"\r\n")
-        for line in lines:
+        for line in self.framer.feed(data):
+            if line is None:
+                self.write(
+                    ERR.INPUTTOOLONG, self.nickname or "*", "Input line was too long"
+                )
+                continue
             line = try_decode(line)
             if not line:
                 continue
+            tags = None
+            if line.startswith("@"):
+                text, _, line = line[1:].partition(" ")
+                tags = parse_tags(text)
             prefix = None
             if line.startswith(":"):
                 prefix, line = line[1:].split(None, 1)
@@ -79,38 +451,82 @@ class IRCSession(asyncio.Protocol):
             cmd, *params = parts[0].split()
             if len(parts) > 1:
                 params.append(parts[1])
-            handler = getattr(self, "handle_{}".format(cmd.upper()), None)
-            if handler:
-                if cmd.upper() not in UNAUTH_COMMANDS and not self.authenticated:
-                    self.write(
-                        ERR.NOTREGISTERED,
-                        self.nickname or "*",
-                        "You are not registered.",
-                    )
-                else:
-                    asyncio.create_task(handler(*params, prefix=prefix))
+            cmd = cmd.upper()
+            _, coroutine, _ = self.commands.get(cmd, (None, False, False))
+            if self.worker is None and not coroutine:
+                # Handlers that never await run inline, unless an earlier command
+                # is still being handled.
+                self.dispatch(cmd, params, prefix, tags)
             else:
-                self.write(
-                    ERR.UNKNOWNCOMMAND, self.nickname or "*", cmd, "Unknown command"
-                )
-                logging.debug('Unknown IRC command "%s" with params: %s', cmd, params)
+                self.pending.append((cmd, params, prefix, tags))
+                if self.worker is None:
+                    self.worker = asyncio.create_task(self.work())
+
+    def dispatch(self, cmd, params, prefix=None, tags=None):
+        if tags and tags.get("batch") in self.batches:
+            self.add_to_batch(tags, cmd, params)
+            return None
+        try:
+            handler, _, unauth = self.commands[cmd]
+        except KeyError:
+            self.write(ERR.UNKNOWNCOMMAND, self.nickname or "*", cmd, "Unknown command")
+            logging.debug('Unknown IRC command "%s" with params: %s', cmd, params)
+            return None
+        if not unauth and not self.authenticated:
+            self.write(
+                ERR.NOTREGISTERED, self.nickname or "*", "You are not registered."
+            )
+            return None
+        try:
+            return handler(self, *params, prefix=prefix)
+        except Exception:
+            logging.exception('Error handling IRC command "%s"', cmd)
+
+    async def work(self):
+        # Runs queued commands one at a time, in the order they arrived.
+        while self.pending:
+            cmd, params, prefix, tags = self.pending.popleft()
+            result = self.dispatch(cmd, params, prefix, tags)
+            if result is not None:
+                try:
+                    await result
+                except Exception:
+                    logging.exception('Error handling IRC command "%s"', cmd)
+        self.worker = None
 
     def write(self, code, *params, prefix=None):
-        start = ":{}".format(prefix or self.server.name)
-        *first, last = [str(p) for p in params]
-        joined = " ".join(first) + (" " if first else "")
-        line = "{} {} {}:{}\r\n".format(start, code, joined, last)
-        self.transport.write(line.encode("utf-8"))
-
-    def message(self, content, sender=None, channel=None):
-        if channel:
-            # Channel message
-            if sender.nickname != self.nickname:
-                # Don't echo messages back to the sender.
-                self.write("PRIVMSG", channel.irc_name, content, prefix=sender)
-        else:
-            # Direct message
-            self.write("PRIVMSG", str(self), content, prefix=sender.nickname)
+        self.send(encode(code, *params, prefix=prefix or self.server.name))
+
+    def send(self, data, droppable=False):
+        """
+        Writes encoded lines to the client. While the client is not keeping up,
+        droppable (channel) traffic is either dropped or held back, keeping
+        only the most recent lines, depending on the sendq_policy.
+        """
+        if self.transport.is_closing():
+            return
+        if self.paused and droppable and self.sendq_policy:
+            if self.sendq_policy == "coalesce":
+                if len(self.backlog) == self.backlog.maxlen:
+                    self.dropped += 1
+                self.backlog.append(data)
+            else:
+                self.dropped += 1
+            return
+        self.transport.write(data)
+        if self.transport.get_write_buffer_size() > self.sendq_max:
+            self.evict("SendQ exceeded")
+
+    def evict(self, reason):
+        self.quit_reason = reason
+        self.transport.write(encode("ERROR", reason, prefix=self.server.name))
+        self.transport.close()
+        # A client that is not reading will never let the buffer drain.
+        asyncio.get_running_loop().call_later(5, self.transport.abort)
+
+    def message(self, content, sender=None):
+        # Direct message, channel messages go through BridgeChannel.send_message.
+        self.write("PRIVMSG", str(self), content, prefix=sender.nickname)
 
     def join(self, user, channel):
         self.write("JOIN", channel.irc_name, prefix=user)
@@ -121,8 +537,95 @@ class IRCSession(asyncio.Protocol):
     def quit(self, user, reason):
         self.write("QUIT", reason, prefix=user)
 
-    async def check_login(self, sasl=False):
-        if self.authenticated:
+    def send_channel_info(self, channel):
+        # The topic and names a client is sent when it joins a channel.
+        if channel.topic:
+            self.write(RPL.TOPIC, self.nickname, channel.irc_name, channel.topic)
+        else:
+            self.write(RPL.NOTOPIC, self.nickname, channel.irc_name)
+        self.send_reply(channel.reply("names", self.nickname))
+
+    def send_reply(self, reply):
+        # Sends (code, [lines from encode_reply]) pairs with this nickname.
+        data = []
+        for code, lines in reply:
+            head = ":{} {} {}".format(self.server.name, code, self.nickname)
+            head = head.encode("utf-8")
+            data.append(head + head.join(lines))
+        self.send(b"".join(data))
+
+    def fail(self, command, code, *params):
+        # https://ircv3.net/specs/extensions/standard-replies
+        self.write("FAIL", command, code, *params)
+
+    def send_history(self, channel, rows, batch=None):
+        """
+        Sends logged (id, timestamp, nickname, message) rows. Clients with
+        server-time get them with their time tags instead of a timestamp in the
+        text, and clients with batch get them in a batch of the given type.
+        """
+        ref = None
+        if batch and "batch" in self.caps:
+            ref = str(next(batch_ids))
+            self.write("BATCH", "+" + ref, batch, channel.irc_name)
+        for id, timestamp, nickname, message in rows:
+            nickname = nickname.replace(" ", "_")
+            tags = [f"batch={ref}"] if ref else []
+            if "server-time" in self.caps:
+                tags.append("time=" + format_time(timestamp))
+            else:
+                stamp = time.strftime("%Y-%m-%d %H:%M", time.gmtime(timestamp))
+                message = "\n".join(
+                    f"[{stamp}] {line}" for line in split_lines(message)
+                )
+            if "message-tags" in self.caps:
+                tags.append(f"msgid={id}")
+            data = encode("PRIVMSG", channel.irc_name, message, prefix=nickname)
+            self.send(tag_lines(data, ";".join(tags)) if tags else data)
+        if ref:
+            self.send(":{} BATCH -{}\r\n".format(self.server.name, ref).encode("utf-8"))
+
+    async def history_bound(self, ref, after=False):
+        # Turns a CHATHISTORY msgid= or timestamp= reference into a (timestamp, id)
+        # bound for MessageLog.history.
+        if ref == "*":
+            return None
+        key, _, value = ref.partition("=")
+        if key == "msgid":
+            bound = await self.server.db.position(int(value))
+            if bound:
+                return bound
+        elif key == "timestamp":
+            return (parse_timestamp(value), (1 << 63) - 1 if after else 0)
+        raise ValueError(ref)
+
+    def add_to_batch(self, tags, cmd, params):
+        ref = tags["batch"]
+        target, lines = self.batches[ref]
+        if cmd != "PRIVMSG" or len(params) < 2 or params[0] != target:
+            del self.batches[ref]
+            self.fail("BATCH", "MULTILINE_INVALID", "Invalid multiline batch")
+            return
+        lines.append(("draft/multiline-concat" in tags, params[1]))
+        if len(lines) > MULTILINE_MAX_LINES:
+            del self.batches[ref]
+            self.fail(
+                "BATCH",
+                "MULTILINE_MAX_LINES",
+                str(MULTILINE_MAX_LINES),
+                "Multiline batch max-lines exceeded",
+            )
+        elif sum(len(text.encode("utf-8")) for _, text in lines) > MULTILINE_MAX_BYTES:
+            del self.batches[ref]
+            self.fail(
+                "BATCH",
+                "MULTILINE_MAX_BYTES",
+                str(MULTILINE_MAX_BYTES),
+                "Multiline batch max-bytes exceeded",
+            )
+
+    def check_login(self, sasl=False):
+        if self.authenticated or self.negotiating:
             return
         if self.username and self.nickname:
             if self.server.password and self.server.password != self.password:
@@ -140,73 +643,138 @@ class IRCSession(asyncio.Protocol):
                     self.server.name, self.server.default_channel.irc_name
                 ),
             )
+            features = [*ISUPPORT, "NETWORK=" + self.server.name]
+            if self.server.db:
+                features.append(f"CHATHISTORY={self.server.history_limit}")
+            self.write(
+                RPL.ISUPPORT, self.nickname, *features, "are supported by this server"
+            )
+
+    def handle_CAP(self, *params, prefix=None):
+        # https://ircv3.net/specs/extensions/capability-negotiation
+        subcommand = params[0].upper() if params else ""
+        nickname = self.nickname or "*"
+        if subcommand == "LS":
+            self.negotiating = not self.authenticated
+            version = params[1] if len(params) > 1 else ""
+            values = version.isdigit() and int(version) >= 302
+            caps = " ".join(
+                f"{name}={value}" if values and value else name
+                for name, value in CAPABILITIES.items()
+                # History is only offered when there is a message log to serve it.
+                if name != "draft/chathistory" or self.server.db
+            )
+            self.write("CAP", nickname, "LS", caps)
+        elif subcommand == "LIST":
+            self.write("CAP", nickname, "LIST", " ".join(sorted(self.caps)))
+        elif subcommand == "REQ":
+            self.negotiating = not self.authenticated
+            requested = params[1].split() if len(params) > 1 else []
+            if all(name.lstrip("-") in CAPABILITIES for name in requested):
+                for name in requested:
+                    if name.startswith("-"):
+                        self.caps.discard(name[1:])
+                    else:
+                        self.caps.add(name)
+                self.message_caps = frozenset(self.caps & MESSAGE_CAPS)
+                if self.caps & TAG_CAPS:
+                    # Tagged lines may be longer than the usual limit.
+                    limit = getattr(self.server, "max_line_length", 512)
+                    self.framer.max_length = limit + MAX_TAGS
+                self.write("CAP", nickname, "ACK", " ".join(requested))
+            else:
+                self.write("CAP", nickname, "NAK", " ".join(requested))
+        elif subcommand == "END":
+            self.negotiating = False
+            self.check_login()
+        else:
+            self.write(
+                ERR.INVALIDCAPCMD, nickname, subcommand, "Invalid CAP subcommand"
+            )
 
-    async def handle_PING(self, *params, prefix=None):
+    def handle_BATCH(self, *params, prefix=None):
+        # https://ircv3.net/specs/extensions/multiline
+        if not params or len(params[0]) < 2:
+            return
+        sign, ref = params[0][0], params[0][1:]
+        if sign == "+":
+            if len(params) < 3 or params[1] != "draft/multiline":
+                self.fail("BATCH", "MULTILINE_INVALID", "Unsupported batch type")
+            elif "draft/multiline" not in self.caps:
+                self.fail("BATCH", "MULTILINE_INVALID", "draft/multiline not enabled")
+            else:
+                self.batches[ref] = (params[2], [])
+        elif sign == "-" and ref in self.batches:
+            target, lines = self.batches.pop(ref)
+            if not lines:
+                return
+            text = lines[0][1]
+            for concat, line in lines[1:]:
+                text += line if concat else "\n" + line
+            self.handle_PRIVMSG(target, text)
+
+    def handle_PING(self, *params, prefix=None):
         self.write("PONG", self.server.name, " ".join(params))
 
-    async def handle_PASS(self, *params, prefix=None):
+    def handle_PASS(self, *params, prefix=None):
         self.password = params[0]
-        await self.check_login()
+        self.check_login()
 
-    async def handle_USER(self, *params, prefix=None):
+    def handle_USER(self, *params, prefix=None):
         self.username = params[0]
         self.realname = params[3]
-        await self.check_login()
+        self.check_login()
 
     async def handle_NICK(self, *params, prefix=None):
         if not params or params[0] == self.nickname:
             return
-        if self.server.valid_nick(params[0]):
+        if len(params[0].encode("utf-8")) > NICK_ROOM:
+            self.write(
+                ERR.ERRONEUSNICKNAME,
+                self.nickname or "*",
+                params[0][:NICK_ROOM],
+                "Nickname too long",
+            )
+        elif await self.server.claim_nick(params[0], session=self):
             old_nickname = self.nickname
             self.nickname = params[0]
+            self.server.nick_changed(self, old_nickname)
             if not self.authenticated:
-                await self.check_login()
+                self.check_login()
             elif self.nickname != old_nickname:
-                for session in self.server.sessions:
-                    session.write("NICK", self.nickname, prefix=old_nickname)
+                # Sent once to everyone sharing a channel, and to the client.
+                data = encode("NICK", self.nickname, prefix=old_nickname)
+                peers = self.server.peers(self.channels)
+                peers[self] = None
+                for session in peers:
+                    session.send(data)
         else:
             self.write(ERR.NICKNAMEINUSE, "*", "Nickname is already in use.")
 
     async def handle_JOIN(self, *params, prefix=None):
-        channel = self.server.channels.get(params[0][1:])
+        channel = self.server.channel(params[0][1:])
         if not channel:
             self.write(ERR.NOSUCHCHANNEL, params[0], "No such channel")
             return
         if self in channel.sessions:
             return
         channel.join(self)
-        if channel.topic:
-            self.write(RPL.TOPIC, self.nickname, channel.irc_name, channel.topic)
-        else:
-            self.write(RPL.NOTOPIC, self.nickname, channel.irc_name)
-        # Channels: = for public, * for private, @ for secret
-        # Users: @ for ops, + for voiced
-        self.write(
-            RPL.NAMREPLY,
-            self.nickname,
-            "=",
-            channel.irc_name,
-            " ".join(u.nickname for u in channel.users()),
-        )
-        self.write(RPL.ENDOFNAMES, self.nickname, channel.irc_name, "End of NAMES list")
+        self.send_channel_info(channel)
+        if self.server.db and self.server.replay:
+            rows = await self.server.db.history(channel.id, limit=self.server.replay)
+            self.send_history(channel, rows)
 
-    async def handle_PART(self, *params, prefix=None):
+    def handle_PART(self, *params, prefix=None):
         reason = params[1] if len(params) > 1 else "Leaving"
         for name in params[0].split(","):
-            channel = self.server.channels.get(name[1:])
+            channel = self.server.channel(name[1:])
             if channel and self in channel.sessions:
                 channel.part(self, reason)
 
-    async def handle_PRIVMSG(self, *params, prefix=None):
+    def handle_PRIVMSG(self, *params, prefix=None):
         content = params[1]
-
-        # translate 0x01ACTION text0x01 to _text_
-        cbytes = str.encode(content, "utf-8")
-        if cbytes[0] == 0x01 and cbytes[-1] == 0x01 and content[1:8] == "ACTION ":
-            content = f"_{content[8:-1]}_"
-
         if params[0].startswith("#"):
-            channel = self.server.channels.get(params[0][1:])
+            channel = self.server.channel(params[0][1:])
             if channel:
                 if self in channel.sessions:
                     channel.message(content, sender=self)
@@ -225,44 +793,142 @@ class IRCSession(asyncio.Protocol):
             user = self.server.user(params[0])
             if user:
                 user.message(content, sender=self)
+                if "echo-message" in self.caps:
+                    self.write("PRIVMSG", user.nickname, content, prefix=self)
             else:
                 self.write(
                     ERR.NOSUCHNICK, self.nickname, params[0], "No such nickname."
                 )
 
-    async def handle_MODE(self, *params, prefix=None):
+    def handle_TAGMSG(self, *params, prefix=None):
+        # Tag-only messages (like typing notifications) have nothing to relay.
         pass
 
-    async def handle_WHO(self, *params, prefix=None):
+    def handle_AWAY(self, *params, prefix=None):
+        self.away = params[0] if params and params[0] else None
+        if self.away:
+            self.write(RPL.NOWAWAY, self.nickname, "You have been marked as away")
+        else:
+            self.write(RPL.UNAWAY, self.nickname, "You are no longer marked as away")
+        self.server.away_changed(self, self.away)
+
+    def handle_MODE(self, *params, prefix=None):
+        pass
+
+    def handle_NAMES(self, *params, prefix=None):
+        for name in params[0].split(",") if params else []:
+            channel = self.server.channel(name[1:])
+            if channel and name.startswith("#"):
+                self.send_reply(channel.reply("names", self.nickname))
+            else:
+                self.write(RPL.ENDOFNAMES, self.nickname, name, "End of NAMES list")
+
+    def handle_WHO(self, *params, prefix=None):
         if params and params[0].startswith("#"):
-            channel = self.server.channels.get(params[0][1:])
-            for user in channel.users():
-                self.write(
-                    RPL.WHOREPLY,
-                    self.nickname,
-                    channel.irc_name,
-                    user.username,
-                    user.hostname,
-                    self.server.name,
-                    user.nickname,
-                    "H",
-                    "0 " + user.realname,
-                )
-            self.write(RPL.ENDOFWHO, self.nickname, channel.irc_name, "End of WHO list")
+            channel = self.server.channel(params[0][1:])
+            if channel:
+                self.send_reply(channel.reply("who", self.nickname))
+            else:
+                self.write(RPL.ENDOFWHO, self.nickname, params[0], "End of WHO list")
 
-    async def handle_LIST(self, *params, prefix=None):
+    def handle_LIST(self, *params, prefix=None):
         self.write(RPL.LISTSTART, self.nickname, "Channel Users Topic")
-        for channel in self.server.channels.values():
-            self.write(
-                RPL.LIST,
-                self.nickname,
-                channel.irc_name,
-                str(channel.num_users),
-                channel.topic,
-            )
+        lines = self.server.list_lines(params[0] if params else None)
+        if lines:
+            self.send_reply(((RPL.LIST, lines),))
         self.write(RPL.LISTEND, self.nickname, "End of LIST")
 
-    async def handle_QUIT(self, *params, prefix=None):
+    async def handle_CHATHISTORY(self, *params, prefix=None):
+        # https://ircv3.net/specs/extensions/chathistory
+        if len(params) < 4:
+            self.fail("CHATHISTORY", "NEED_MORE_PARAMS", "Missing parameters")
+            return
+        subcommand, target, ref, limit = params[0].upper(), *params[1:4]
+        channel = self.server.channel(target[1:])
+        if not target.startswith("#") or not channel:
+            self.fail(
+                "CHATHISTORY", "INVALID_TARGET", subcommand, target, "No such channel"
+            )
+            return
+        if not self.server.db:
+            self.fail(
+                "CHATHISTORY",
+                "MESSAGE_ERROR",
+                subcommand,
+                target,
+                "No history available",
+            )
+            return
+        if not limit.isdecimal() or int(limit) < 1:
+            self.fail(
+                "CHATHISTORY", "INVALID_PARAMS", subcommand, limit, "Invalid limit"
+            )
+            return
+        limit = min(int(limit), self.server.history_limit)
+        try:
+            if subcommand == "LATEST":
+                bound = await self.history_bound(ref, after=True)
+                rows = await self.server.db.history(
+                    channel.id, after=bound, limit=limit
+                )
+            elif subcommand == "BEFORE" and ref != "*":
+                bound = await self.history_bound(ref)
+                rows = await self.server.db.history(
+                    channel.id, before=bound, limit=limit
+                )
+            elif subcommand == "AFTER" and ref != "*":
+                bound = await self.history_bound(ref, after=True)
+                rows = await self.server.db.history(
+                    channel.id, after=bound, limit=limit, newest=False
+                )
+            else:
+                self.fail(
+                    "CHATHISTORY", "INVALID_PARAMS", subcommand, "Unsupported request"
+                )
+                return
+        except ValueError:
+            self.fail(
+                "CHATHISTORY", "INVALID_PARAMS", subcommand, ref, "Invalid reference"
+            )
+            return
+        self.send_history(channel, rows, batch="chathistory")
+
+    async def handle_SEARCH(self, *params, prefix=None):
+        # The draft/search syntax used by Ergo: SEARCH in=#channel;text=words;limit=10
+        # Results are paged with before=<msgid> of the oldest result so far.
+        if not params:
+            self.fail("SEARCH", "NEED_MORE_PARAMS", "Missing parameters")
+            return
+        query = dict(item.partition("=")[::2] for item in params[0].split(";"))
+        target = query.get("in", "")
+        channel = self.server.channel(target[1:])
+        if not target.startswith("#") or not channel:
+            self.fail("SEARCH", "INVALID_PARAMS", target, "No such channel")
+            return
+        if not query.get("text", "").strip():
+            self.fail("SEARCH", "INVALID_PARAMS", "Missing search text")
+            return
+        if not self.server.db:
+            self.fail("SEARCH", "INVALID_PARAMS", target, "No history available")
+            return
+        limit = query.get("limit", "10")
+        if not limit.isdecimal() or int(limit) < 1:
+            self.fail("SEARCH", "INVALID_PARAMS", limit, "Invalid limit")
+            return
+        limit = min(int(limit), self.server.history_limit)
+        before = query.get("before")
+        if before is not None and not before.isdecimal():
+            self.fail("SEARCH", "INVALID_PARAMS", before, "Invalid msgid")
+            return
+        rows = await self.server.db.search(
+            channel.id,
+            query["text"],
+            before=int(before) if before else None,
+            limit=limit,
+        )
+        self.send_history(channel, rows)
+
+    def handle_QUIT(self, *params, prefix=None):
         if params:
             self.quit_reason = params[0]
         self.write("ERROR", "Bye for now!")
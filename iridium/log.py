@@ -0,0 +1,264 @@
+import asyncio
+import logging
+
+import aiosqlite
+
+# Each script brings the database up to the schema version of its position in
+# this list (starting at 1), tracked with pragma user_version.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY,
+        timestamp INTEGER,
+        channel TEXT,
+        nickname TEXT,
+        message TEXT
+    );
+    """,
+    """
+    CREATE INDEX logs_channel_timestamp ON logs (channel, timestamp, id);
+    CREATE VIRTUAL TABLE logs_fts USING fts5(
+        message, content='logs', content_rowid='id'
+    );
+    CREATE TRIGGER logs_insert AFTER INSERT ON logs BEGIN
+        INSERT INTO logs_fts (rowid, message) VALUES (new.id, new.message);
+    END;
+    CREATE TRIGGER logs_delete AFTER DELETE ON logs BEGIN
+        INSERT INTO logs_fts (logs_fts, rowid, message)
+        VALUES ('delete', old.id, old.message);
+    END;
+    CREATE TRIGGER logs_update AFTER UPDATE ON logs BEGIN
+        INSERT INTO logs_fts (logs_fts, rowid, message)
+        VALUES ('delete', old.id, old.message);
+        INSERT INTO logs_fts (rowid, message) VALUES (new.id, new.message);
+    END;
+    INSERT INTO logs_fts (logs_fts) VALUES ('rebuild');
+    """,
+    """
+    CREATE TABLE webhooks (
+        channel_id INTEGER PRIMARY KEY,
+        name TEXT,
+        webhook_id INTEGER,
+        token TEXT
+    );
+    """,
+    # Channels are renamed in place, so history is kept by Discord channel id.
+    # Older rows only have a name, see MessageLog.assign_channels.
+    """
+    ALTER TABLE logs ADD COLUMN channel_id INTEGER;
+    DROP INDEX logs_channel_timestamp;
+    CREATE INDEX logs_channel_id_timestamp ON logs (channel_id, timestamp, id);
+    CREATE INDEX logs_unassigned ON logs (channel) WHERE channel_id IS NULL;
+    """,
+]
+
+
+class MessageLog:
+    """
+    Write-behind sqlite log of Discord messages. Rows are queued in memory and
+    written with a single executemany per transaction, either once batch_size
+    rows are waiting or every flush_interval milliseconds. The same database
+    caches the webhooks used to relay IRC messages to Discord. A readonly log
+    only serves history, for processes other than the one writing it.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=250, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval / 1000.0
+        self.db = None
+        self.rows = []
+        self.ready = asyncio.Event()
+        self.closing = False
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def open(self):
+        if self.readonly:
+            self.db = await aiosqlite.connect(f"file:{self.path}?mode=ro", uri=True)
+            return
+        self.db = await aiosqlite.connect(self.path, isolation_level=None)
+        await self.db.execute("pragma journal_mode=wal")
+        await self.db.execute("pragma synchronous=normal")
+        await self.migrate()
+        self.writer = asyncio.create_task(self.run())
+
+    async def migrate(self):
+        async with self.db.execute("pragma user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        for number, script in enumerate(MIGRATIONS[version:], version + 1):
+            print("Migrating message log to version", number)
+            await self.db.executescript(
+                f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;"
+            )
+
+    async def close(self):
+        # Let the writer drain whatever is still queued before closing.
+        self.closing = True
+        self.ready.set()
+        if self.writer:
+            await self.writer
+        await self.db.close()
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.ready.set()
+
+    async def run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.ready.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.rows:
+                return
+            rows, self.rows = self.rows, []
+            try:
+                await self.insert(rows)
+            except Exception:
+                logging.exception("Logging %d messages failed", len(rows))
+                # Retry one at a time, so one bad row does not lose the batch.
+                for row in rows:
+                    try:
+                        await self.insert([row])
+                    except Exception:
+                        logging.exception("Logging message %s failed", row[0])
+
+    async def insert(self, rows):
+        try:
+            await self.db.execute("BEGIN")
+            # Edits are logged under the id of the original message, keep it.
+            await self.db.executemany(
+                """
+                INSERT OR IGNORE INTO logs
+                    (id, timestamp, channel_id, channel, nickname, message)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            await self.db.execute("COMMIT")
+        except Exception:
+            if self.db.in_transaction:
+                await self.db.execute("ROLLBACK")
+            raise
+
+    async def assign_channels(self, channels):
+        """
+        Files rows logged before channel ids were under the id of the channel
+        that has their channel name now, given as a dict of names to ids.
+        """
+        async with self.lock:
+            await self.db.executemany(
+                """
+                UPDATE logs SET channel_id = ? WHERE channel_id IS NULL AND channel = ?
+                """,
+                [(id, name) for name, id in channels.items()],
+            )
+
+    async def webhook(self, channel_id, name):
+        """
+        Returns the cached (webhook_id, token) for the named webhook of a channel,
+        or None if it is not cached.
+        """
+        async with self.db.execute(
+            "SELECT webhook_id, token FROM webhooks WHERE channel_id = ? AND name = ?",
+            (channel_id, name),
+        ) as cursor:
+            return await cursor.fetchone()
+
+    async def save_webhook(self, channel_id, name, webhook_id, token):
+        async with self.lock:
+            await self.db.execute(
+                """
+                INSERT OR REPLACE INTO webhooks (channel_id, name, webhook_id, token)
+                VALUES (?, ?, ?, ?)
+                """,
+                (channel_id, name, webhook_id, token),
+            )
+
+    async def forget_webhook(self, channel_id):
+        async with self.lock:
+            await self.db.execute(
+                "DELETE FROM webhooks WHERE channel_id = ?", (channel_id,)
+            )
+
+    async def position(self, id):
+        """
+        Returns the (timestamp, id) of a logged message, for use as a history
+        bound, or None if the message is not in the log.
+        """
+        await self.flush()
+        async with self.db.execute(
+            "SELECT timestamp, id FROM logs WHERE id = ?", (id,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+    async def history(self, channel_id, before=None, after=None, limit=50, newest=True):
+        """
+        Returns up to limit (id, timestamp, nickname, message) rows logged in
+        the channel strictly between the (timestamp, id) bounds given, oldest first.
+        When there are more than limit rows, the newest ones are returned unless
+        newest is False.
+        """
+        await self.flush()
+        where = ["channel_id = ?"]
+        params = [channel_id]
+        if before:
+            where.append("(timestamp, id) < (?, ?)")
+            params.extend(before)
+        if after:
+            where.append("(timestamp, id) > (?, ?)")
+            params.extend(after)
+        order = "DESC" if newest else "ASC"
+        params.append(limit)
+        async with self.db.execute(
+            f"""
+            SELECT id, timestamp, nickname, message FROM logs
+            WHERE {" AND ".join(where)}
+            ORDER BY timestamp {order}, id {order}
+            LIMIT ?
+            """,
+            params,
+        ) as cursor:
+            rows = await cursor.fetchall()
+        if newest:
+            rows.reverse()
+        return rows
+
+    async def search(self, channel_id, text, before=None, limit=50):
+        """
+        Returns up to limit of the newest rows logged in the channel containing all
+        the words in text, oldest first. Pass the id of the oldest row returned
+        as before to get the next page.
+        """
+        await self.flush()
+        # Quote each word so none of them is parsed as FTS query syntax.
+        query = " ".join(
+            '"{}"'.format(word.replace('"', '""')) for word in text.split()
+        )
+        where = ["logs_fts MATCH ?", "logs.channel_id = ?"]
+        params = [query, channel_id]
+        if before is not None:
+            where.append("logs_fts.rowid < ?")
+            params.append(before)
+        params.append(limit)
+        async with self.db.execute(
+            f"""
+            SELECT logs.id, logs.timestamp, logs.nickname, logs.message
+            FROM logs_fts JOIN logs ON logs.id = logs_fts.rowid
+            WHERE {" AND ".join(where)}
+            ORDER BY logs_fts.rowid DESC
+            LIMIT ?
+            """,
+            params,
+        ) as cursor:
+            rows = await cursor.fetchall()
+        rows.reverse()
+        return rows
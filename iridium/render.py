@@ -0,0 +1,128 @@
+import re
+from collections import OrderedDict
+from functools import partial
+
+EMOJI_URL = "https://cdn.discordapp.com/emojis/"
+
+# IRC formatting codes.
+BOLD = "\x02"
+ITALIC = "\x1d"
+UNDERLINE = "\x1f"
+STRIKETHROUGH = "\x1e"
+MONOSPACE = "\x11"
+COLOR = "\x03"
+
+# Everything rewritten in a message, matched in a single pass. Exactly one named
+# group matches, and its name says what was found.
+PATTERN = re.compile(
+    r"""
+    \\(?P<escaped>[\\*_~`|<>])
+    | ```(?:[\w+-]*\n)?(?P<codeblock>(?s:.*?))```
+    | `(?P<code>[^`\n]+)`
+    | <a?:\w+:(?P<emoji>\d+)>
+    | <@[!&]?(?P<mention>\d+)>
+    | <\#(?P<channel>\d+)>
+    | \*\*(?P<bold>.+?)\*\*
+    | __(?P<underline>.+?)__
+    | ~~(?P<strikethrough>.+?)~~
+    | \|\|(?P<spoiler>.+?)\|\|
+    | \*(?P<italic>[^*\s](?:[^*]*?[^*\s])?)\*
+    | \b_(?P<underscore>[^_\n]+?)_\b
+    """,
+    re.VERBOSE,
+)
+
+# Markdown group to the IRC codes wrapping its (formatted) contents.
+FORMATS = {
+    "bold": (BOLD, BOLD),
+    "underline": (UNDERLINE, UNDERLINE),
+    "strikethrough": (STRIKETHROUGH, STRIKETHROUGH),
+    "italic": (ITALIC, ITALIC),
+    "underscore": (ITALIC, ITALIC),
+    # Black on black, readable by selecting it.
+    "spoiler": (COLOR + "01,01", COLOR),
+}
+
+
+def wrap(text, start, end):
+    # Codes don't carry over to the next line once the message is split.
+    return "\n".join(start + line + end for line in text.split("\n"))
+
+
+def replace(names, match):
+    kind = match.lastgroup
+    text = match.group(kind)
+    if kind == "escaped":
+        return text
+    if kind == "codeblock":
+        return wrap(text.strip("\n"), MONOSPACE, MONOSPACE)
+    if kind == "code":
+        return MONOSPACE + text + MONOSPACE
+    if kind == "emoji":
+        return f"{EMOJI_URL}{text}.png"
+    if kind in ("mention", "channel"):
+        return names.get(int(text), match.group(0))
+    start, end = FORMATS[kind]
+    return wrap(PATTERN.sub(partial(replace, names), text), start, end)
+
+
+def mention_names(message):
+    names = {}
+    for user in message.mentions:
+        names[user.id] = "@" + user.display_name
+    for role in message.role_mentions:
+        names[role.id] = "@" + role.name
+    for channel in message.channel_mentions:
+        names[channel.id] = "#" + channel.name
+    return names
+
+
+def format_content(message):
+    """
+    Converts the content of a Discord message to IRC text: mentions become
+    names, custom emoji become image links and markdown becomes IRC formatting
+    codes.
+    """
+    return PATTERN.sub(partial(replace, mention_names(message)), message.content)
+
+
+class Renderer:
+    """
+    Renders Discord messages as lines of IRC text, keeping the most recently
+    rendered messages so that edits, replies and reactions reuse them.
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        # Message id to (edited_at, body lines, attachment lines).
+        self.messages = OrderedDict()
+
+    def render(self, message):
+        entry = self.messages.get(message.id)
+        if entry is not None and entry[0] == message.edited_at:
+            self.messages.move_to_end(message.id)
+            return entry
+        # Not splitlines(), which also splits on some of the formatting codes.
+        text = format_content(message).replace("\r\n", "\n")
+        body = tuple(line for line in text.split("\n") if line)
+        attachments = tuple(
+            f"{att.url} ({att.filename} - {att.size})" for att in message.attachments
+        )
+        entry = self.messages[message.id] = (message.edited_at, body, attachments)
+        self.messages.move_to_end(message.id)
+        while len(self.messages) > self.size:
+            self.messages.popitem(last=False)
+        return entry
+
+    def lines(self, message, edited=False):
+        _, body, attachments = self.render(message)
+        if edited and body:
+            body = ("* " + body[0],) + body[1:]
+        return body + attachments
+
+    def quote(self, message):
+        _, body, attachments = self.render(message)
+        text = body[0] if body else attachments[0] if attachments else ""
+        if len(body) > 1:
+            text += "[...]"
+        return f"<{message.author.name}> {text}"
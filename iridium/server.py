@@ -1,94 +1,394 @@
 import asyncio
-import sys
+import logging
+import os
+import signal
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timezone
 
-import aiosqlite
+import aiohttp
+import discord
 
 from .bridge import BridgeClient, UserProxy, get_user_proxies
-from .irc import IRCSession
+from .constants import RPL
+from .ipc import Hub, RemoteUser
+from .irc import (
+    NICK_ROOM,
+    IRCSession,
+    casefold,
+    encode,
+    encode_list_reply,
+    encode_message,
+    encode_reply,
+    format_action,
+    mask_pattern,
+    timestamp,
+)
+from .log import MessageLog
+from .webhook import WebhookQueue
+
+# Discord statuses shown as away on IRC, and their away messages.
+AWAY_STATUSES = {
+    "idle": "Idle",
+    "dnd": "Do not disturb",
+    "offline": "Offline",
+}
 
 
 class BridgeChannel:
-    def __init__(self, name):
+    def __init__(self, name, server=None, id=None):
+        self.server = server
+        self.id = id
         self.name = name
         self.irc_name = "#" + self.name
         self.topic = ""
+        # When the topic last changed, as far as this server has seen (0 if it
+        # hasn't changed since startup).
+        self.topic_time = 0
         # Mapping of discord username to UserProxy.
         self.members = {}
-        # List of active IRCSession objects in this channel.
-        self.sessions = []
+        # Active IRCSession objects in this channel, in the order they joined
+        # (the values are unused).
+        self.sessions = {}
+        # Nickname to RemoteUser for IRC users connected to other processes.
+        self.remote = {}
+        # Encoded NAMES and WHO replies, until the membership changes.
+        self.replies = {}
         self.webhook = None
+        self.webhook_name = "IRC"
+        self.webhook_lock = asyncio.Lock()
+        self.outbox = WebhookQueue(
+            self.send,
+            rate=getattr(server, "webhook_rate", 5),
+            per=getattr(server, "webhook_per", 2.0),
+            stats=getattr(server, "stats", None),
+        )
         self.default = False
         self.log = True
 
     @property
     def num_users(self):
-        return len(self.sessions) + len(self.members)
+        return len(self.sessions) + len(self.members) + len(self.remote)
+
+    def publish(self, event):
+        # Passes channel events on to the worker processes, if there are any.
+        hub = getattr(self.server, "hub", None)
+        if hub:
+            hub.publish(event)
 
     async def configure(self, bridge, **options):
-        channel = bridge.named_channel(self.name)
+        channel = bridge.get_channel(self.id)
         webhook_name = options.get("webhook", "IRC")
-        self.topic = channel.topic
+        topic = channel.topic or ""
+        members = get_user_proxies(channel)
+        if (
+            topic != self.topic
+            or members.keys() != self.members.keys()
+            or self.renamed(members)
+        ):
+            self.invalidate()
+        self.topic = topic
         self.default = options.get("default", self.default)
         self.log = options.get("log", self.log)
-        self.webhook = None
-        for hook in await channel.webhooks():
-            if hook.name == webhook_name:
-                self.webhook = hook
-                break
-        if self.webhook is None:
-            self.webhook = await channel.create_webhook(name=webhook_name)
-        self.members = get_user_proxies(channel)
+        # The webhook is looked up when it's first needed, see get_webhook.
+        if webhook_name != self.webhook_name:
+            self.webhook_name = webhook_name
+            self.webhook = None
+        self.members = members
+
+    async def get_webhook(self):
+        async with self.webhook_lock:
+            if self.webhook is None:
+                self.webhook = await self.find_webhook()
+        return self.webhook
+
+    async def find_webhook(self):
+        db = self.server.db
+        if db:
+            cached = await db.webhook(self.id, self.webhook_name)
+            if cached:
+                return self.server.bridge.partial_webhook(*cached)
+        async with self.server.rest_limit:
+            channel = self.server.bridge.get_channel(self.id)
+            for hook in await channel.webhooks():
+                if hook.name == self.webhook_name:
+                    webhook = hook
+                    break
+            else:
+                webhook = await channel.create_webhook(name=self.webhook_name)
+        if db:
+            await db.save_webhook(self.id, self.webhook_name, webhook.id, webhook.token)
+        return webhook
+
+    async def send(self, content, username):
+        webhook = await self.get_webhook()
+        try:
+            await webhook.send(content, username=username)
+        except discord.NotFound:
+            # The webhook was deleted since it was cached, so find or make another.
+            if self.server.db:
+                await self.server.db.forget_webhook(self.id)
+            if self.webhook is webhook:
+                self.webhook = None
+            webhook = await self.get_webhook()
+            await webhook.send(content, username=username)
 
     async def sync(self, bridge):
-        channel = bridge.named_channel(self.name)
+        channel = bridge.get_channel(self.id)
         new_topic = channel.topic or ""
         if new_topic != self.topic:
             self.topic = new_topic
+            self.topic_time = datetime.now(timezone.utc).timestamp()
+            self.invalidate()
             for session in self.sessions:
                 session.write("TOPIC", self.irc_name, self.topic)
+            self.publish(("topic", self.id, self.topic))
         new_members = get_user_proxies(channel)
         for user in set(new_members).difference(self.members):
             self.join(new_members[user])
         for user in set(self.members).difference(new_members):
             self.part(self.members[user], "Leaving")
+        if self.renamed(new_members):
+            self.invalidate()
         self.members = new_members
 
-    def join(self, user):
-        if isinstance(user, IRCSession) and user not in self.sessions:
-            self.sessions.append(user)
+    def renamed(self, members):
+        # Whether any of members is in the channel under a different nickname.
+        return any(
+            self.members[user].nickname != proxy.nickname
+            for user, proxy in members.items()
+            if user in self.members
+        )
+
+    def update_member(self, member, visible):
+        """
+        Brings a single Discord member's presence in the channel up to date,
+        returning "join" or "part" if that changed their membership.
+        """
+        old = self.members.get(member.name)
+        if visible:
+            user = self.members[member.name] = UserProxy(member)
+            if old is None:
+                self.join(user)
+                return "join"
+            if old.nickname != user.nickname:
+                self.invalidate()
+        elif old is not None:
+            # By their current nickname, which peers were already told about.
+            self.part(UserProxy(member), "Leaving")
+            del self.members[member.name]
+            return "part"
+        return None
+
+    def invalidate(self):
+        self.replies.clear()
+        if self.server is not None:
+            self.server.list_cache = None
+
+    def reply(self, kind, nickname):
+        """
+        Returns the "names" or "who" reply for IRCSession.send_reply. It is
+        encoded once for every client whose nickname fits in NICK_ROOM bytes.
+        """
+        room = len(nickname.encode("utf-8"))
+        if room > NICK_ROOM:
+            return self.encode_reply(kind, room)
+        reply = self.replies.get(kind)
+        if reply is None:
+            reply = self.replies[kind] = self.encode_reply(kind, NICK_ROOM)
+        return reply
+
+    def encode_reply(self, kind, room):
+        name = self.server.name
+        if kind == "names":
+            # Channels: = for public, * for private, @ for secret
+            # Users: @ for ops, + for voiced
+            nicknames = [user.nickname for user in self.users()]
+            lines = encode_list_reply(
+                RPL.NAMREPLY,
+                "=",
+                self.irc_name,
+                items=nicknames,
+                prefix=name,
+                room=room,
+            )
+            end = encode_reply(
+                RPL.ENDOFNAMES, self.irc_name, "End of NAMES list", prefix=name
+            )
+            return ((RPL.NAMREPLY, lines), (RPL.ENDOFNAMES, [end]))
+        lines = [
+            encode_reply(
+                RPL.WHOREPLY,
+                self.irc_name,
+                user.username,
+                user.hostname,
+                name,
+                user.nickname,
+                "H",
+                "0 " + user.realname,
+                prefix=name,
+                room=room,
+            )
+            for user in self.users()
+        ]
+        end = encode_reply(RPL.ENDOFWHO, self.irc_name, "End of WHO list", prefix=name)
+        return ((RPL.WHOREPLY, lines), (RPL.ENDOFWHO, [end]))
+
+    def broadcast(self, code, *params, prefix, droppable=False):
+        # Encode the line once and hand the same bytes to every session.
+        data = encode(code, *params, prefix=prefix)
         for session in self.sessions:
-            session.join(user, self)
+            session.send(data, droppable=droppable)
+
+    def join(self, user):
+        if isinstance(user, IRCSession):
+            self.sessions[user] = None
+            user.channels.add(self)
+        elif not isinstance(user, RemoteUser):
+            self.publish(("join", self.id, RemoteUser.of(user)))
+        self.invalidate()
+        self.broadcast("JOIN", self.irc_name, prefix=user)
 
     def part(self, user, reason):
-        for session in self.sessions:
-            session.part(user, self, reason)
-        if isinstance(user, IRCSession) and user in self.sessions:
-            self.sessions.remove(user)
+        self.broadcast("PART", self.irc_name, reason, prefix=user)
+        if isinstance(user, IRCSession):
+            self.sessions.pop(user, None)
+            user.channels.discard(self)
+        elif not isinstance(user, RemoteUser):
+            self.publish(("part", self.id, user.nickname, reason))
+        self.invalidate()
 
-    def quit(self, user, reason):
-        for session in self.sessions:
-            session.quit(user, reason)
-        if isinstance(user, IRCSession) and user in self.sessions:
-            self.sessions.remove(user)
+    def quit(self, user):
+        # Server.quit tells the channel's sessions, once for all channels.
+        if isinstance(user, IRCSession):
+            self.sessions.pop(user, None)
+            user.channels.discard(self)
+        else:
+            self.remote.pop(user.nickname, None)
+        self.invalidate()
 
-    def message(self, content, sender=None):
+    def message(self, content, sender=None, time=None, msgid=None):
         if isinstance(sender, IRCSession):
             if sender in self.sessions:
-                asyncio.create_task(
-                    self.webhook.send(content, username=sender.nickname)
-                )
+                self.relay(sender, content)
+                # Other IRC users see it right away rather than when Discord
+                # echoes it back, which the bridge ignores, and so does the
+                # sender if they asked for echo-message.
+                skip = None if "echo-message" in sender.caps else sender
+                self.send_message(content, sender, skip=skip)
         else:
-            for session in self.sessions:
-                session.message(content, sender=sender, channel=self)
+            self.send_message(content, sender, time=time, msgid=msgid)
+            user = RemoteUser.of(sender)
+            self.publish(("msg", self.id, user, content, timestamp(time), msgid))
+
+    def relay(self, sender, content):
+        # Sends a message from an IRC user on to Discord.
+        self.outbox.put(sender.nickname, format_action(content))
+
+    def send_message(self, content, sender, skip=None, time=None, msgid=None):
+        # Each session gets the message encoded for its capabilities, and each
+        # encoding is only done once.
+        if time is None:
+            time = datetime.now(timezone.utc)
+        encoded = {}
+        for session in self.sessions:
+            if session is skip:
+                continue
+            data = encoded.get(session.message_caps)
+            if data is None:
+                data = encoded[session.message_caps] = encode_message(
+                    self.irc_name,
+                    content,
+                    sender,
+                    session.message_caps,
+                    time=time,
+                    msgid=msgid,
+                )
+            session.send(data, droppable=True)
+
+    def rename(self, name):
+        # IRC has no channel renames, so sessions leave the old name and join
+        # the new one.
+        for session in self.sessions:
+            session.part(session, self, "Channel renamed")
+        self.name = name
+        self.irc_name = "#" + name
+        self.invalidate()
+        for session in self.sessions:
+            session.join(session, self)
+            session.send_channel_info(self)
+        self.publish(("renamed", self.id, name))
+
+    def sent_by_bridge(self, message):
+        # Messages IRC users sent through the webhook were relayed to IRC already.
+        return self.webhook is not None and message.webhook_id == self.webhook.id
 
     def users(self):
         yield from self.members.values()
+        yield from self.remote.values()
         yield from self.sessions
 
     def clear(self):
         for session in self.sessions:
             session.part(session, self, "RIP")
-        self.sessions = []
+            session.channels.discard(self)
+        self.sessions = {}
+        self.invalidate()
+
+
+class Nicknames:
+    """
+    Case-folded index of the nicknames in use by IRC sessions and Discord
+    members, so collision checks and lookups don't scan every user.
+    """
+
+    def __init__(self):
+        # Folded nickname to the IRCSession using it.
+        self.sessions = {}
+        # Folded nickname to the number of Discord members displayed with it.
+        self.members = Counter()
+        # Discord member id to the folded nickname they were added with.
+        self.member_nicks = {}
+
+    def available(self, nick, session=None):
+        folded = casefold(nick)
+        if folded in self.members:
+            return False
+        return self.sessions.get(folded, session) is session
+
+    def session(self, nick):
+        return self.sessions.get(casefold(nick))
+
+    def rename_session(self, session, old_nickname):
+        self.discard(session, old_nickname)
+        self.sessions[casefold(session.nickname)] = session
+
+    def remove_session(self, session):
+        self.discard(session, session.nickname)
+
+    def discard(self, session, nickname):
+        folded = casefold(nickname)
+        if self.sessions.get(folded) is session:
+            del self.sessions[folded]
+
+    def add_member(self, member):
+        self.remove_member(member)
+        folded = casefold(UserProxy(member).nickname)
+        self.member_nicks[member.id] = folded
+        self.members[folded] += 1
+
+    def remove_member(self, member):
+        folded = self.member_nicks.pop(member.id, None)
+        if folded is not None:
+            self.members[folded] -= 1
+            if not self.members[folded]:
+                del self.members[folded]
+
+    def reset_members(self, members):
+        self.members.clear()
+        self.member_nicks.clear()
+        for member in members:
+            self.add_member(member)
 
 
 class Server:
@@ -97,14 +397,60 @@ class Server:
         self.loop = None
         self.server = None
         self.bridge = None
-        self.sessions = []
+        # Connected IRCSession objects, in the order they connected.
+        self.sessions = {}
         self.name = self.config.get("irc", {}).get("name", "Iridium")
         self.password = self.config.get("irc", {}).get("password", "")
         self.host = self.config.get("irc", {}).get("bind", "0.0.0.0")
         self.port = self.config.get("irc", {}).get("port", 6667)
         self.automap = self.config.get("irc", {}).get("automap", True)
+        self.max_line_length = self.config.get("irc", {}).get("max_line_length", 512)
+        self.sendq_high = self.config.get("irc", {}).get("sendq_high", 64 * 1024)
+        self.sendq_max = self.config.get("irc", {}).get("sendq_max", 1024 * 1024)
+        self.sendq_policy = self.config.get("irc", {}).get("sendq_policy")
+        self.sendq_backlog = self.config.get("irc", {}).get("sendq_backlog", 100)
+        # Discord channel id to BridgeChannel, and channel name to id.
         self.channels = {}
+        self.channel_ids = {}
+        # Encoded LIST lines and their ELIST index, see listing.
+        self.list_cache = None
+        # With workers, IRC clients are served by that many worker processes (see
+        # worker.py), and this process talks to them over a Unix socket.
+        self.workers = self.config.get("irc", {}).get("workers", 0)
+        self.ipc_path = self.config.get("irc", {}).get("ipc_path", "iridium.sock")
+        self.hub = None
+        # Folded nickname to RemoteUser for IRC users connected to workers.
+        self.remote_users = {}
+        # Folded nickname to the link of the worker it was granted to, until the
+        # worker reports the NICK.
+        self.claims = {}
+        self.ready = False
+        self.nicknames = Nicknames()
+        self.http = None
+        # Counts of work done by event handlers, for diagnostics.
+        self.stats = Counter()
+        self.reconfigure_delay = self.config.get("discord", {}).get(
+            "reconfigure_delay", 2.0
+        )
+        self.reconfigure_lock = asyncio.Lock()
+        # Messages each channel's webhook may send per period (in seconds).
+        self.webhook_rate = self.config.get("discord", {}).get("webhook_rate", 5)
+        self.webhook_per = self.config.get("discord", {}).get("webhook_per", 2.0)
+        # Bounds how many channels talk to the Discord REST API at once.
+        self.rest_limit = asyncio.Semaphore(
+            self.config.get("discord", {}).get("concurrency", 4)
+        )
+        self.reconfigure_timer = None
+        self.reconfigure_deadline = 0
+        self.reconfigure_ids = set()
         self.db = None
+        # Number of logged messages replayed on JOIN, and the most CHATHISTORY
+        # and SEARCH will return at once.
+        self.replay = self.config.get("logging", {}).get("replay", 0)
+        self.history_limit = self.config.get("logging", {}).get("history_limit", 100)
+
+    def channel(self, name):
+        return self.channels.get(self.channel_ids.get(name))
 
     @property
     def default_channel(self):
@@ -118,113 +464,464 @@ class Server:
 
     async def start(self):
         self.loop = asyncio.get_running_loop()
-        self.server = await self.loop.create_server(
-            lambda: IRCSession(self),
-            host=self.host,
-            port=self.port,
-            start_serving=False,
-        )
-        db_file = self.config.get("logging", {}).get("messages")
-        if db_file:
-            self.db = await aiosqlite.connect(
-                db_file, loop=self.loop, isolation_level=None
+        if not self.workers:
+            self.server = await self.loop.create_server(
+                lambda: IRCSession(self),
+                host=self.host,
+                port=self.port,
+                start_serving=False,
             )
-            async with self.db.execute("pragma table_info(logs)") as cursor:
-                cols = await cursor.fetchall()
-                if not cols:
-                    await cursor.execute(
-                        """
-                        CREATE TABLE logs (
-                            id INTEGER PRIMARY KEY,
-                            timestamp INTEGER,
-                            channel TEXT,
-                            nickname TEXT,
-                            message TEXT
-                        )
-                        """
-                    )
+        if self.workers:
+            # Listen for workers first, opening the log may take a while.
+            if os.path.exists(self.ipc_path):
+                os.unlink(self.ipc_path)
+            self.hub = Hub(
+                self.ipc_path,
+                self.worker_connected,
+                self.worker_event,
+                self.worker_disconnected,
+            )
+            await self.hub.start()
+        options = self.config.get("logging", {})
+        if options.get("messages"):
+            self.db = MessageLog(
+                options["messages"],
+                batch_size=options.get("batch_size", 100),
+                flush_interval=options.get("flush_interval", 250),
+            )
+            await self.db.open()
+        # One pooled HTTP client shared by all command handlers.
+        options = self.config.get("http", {})
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=options.get("limit", 100),
+                limit_per_host=options.get("limit_per_host", 10),
+            ),
+            timeout=aiohttp.ClientTimeout(total=options.get("timeout", 10)),
+        )
         self.bridge = BridgeClient(self, loop=self.loop)
+        if hasattr(signal, "SIGHUP"):
+            self.loop.add_signal_handler(signal.SIGHUP, self.bridge.commands.reload)
         await self.bridge.start(self.config["discord"]["token"])
 
     async def stop(self):
-        self.server.close()
-        await self.server.wait_closed()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.hub:
+            await self.hub.stop()
+            os.unlink(self.ipc_path)
         await self.bridge.close()
+        await self.http.close()
         if self.db:
             await self.db.close()
 
-    async def reconfigure(self):
-        print("Configuring channels...")
-        new_channels = {}
-        for channel in self.bridge.guild.text_channels:
-            options = self.config.get("channels", {}).get(channel.name, {})
-            if options or self.automap:
-                old_channel = self.channels.get(channel.name)
-                new_channel = BridgeChannel(channel.name)
-                await new_channel.configure(self.bridge, **options)
-                if old_channel:
-                    new_channel.sessions.extend(old_channel.sessions)
-                    print("  ~", channel.name)
-                else:
-                    print("  +", channel.name)
-                await new_channel.sync(self.bridge)
-                new_channels[channel.name] = new_channel
-        # If any of the channels have gone away, clear them out on IRC as well.
-        for name, channel in self.channels.items():
-            if name not in new_channels:
-                print("  -", name)
-                channel.clear()
-        self.channels = new_channels
+    async def reconfigure(self, ids=None):
+        """
+        Brings the bridged channels in line with the guild's text channels. Only
+        new channels and those in ids (all of them if ids is None) are
+        configured, other existing channels are kept as they are.
+        """
+        async with self.reconfigure_lock:
+            print("Configuring channels...")
+            new_channels = {}
+            changed = []
+            for channel in self.bridge.guild.text_channels:
+                options = self.config.get("channels", {}).get(channel.name, {})
+                if options or self.automap:
+                    bridged = self.channels.get(channel.id)
+                    if bridged and bridged.name != channel.name:
+                        bridged.rename(channel.name)
+                    if bridged and ids is not None and channel.id not in ids:
+                        new_channels[channel.id] = bridged
+                        continue
+                    if bridged:
+                        print("  ~", channel.name)
+                    else:
+                        bridged = BridgeChannel(
+                            channel.name, server=self, id=channel.id
+                        )
+                        print("  +", channel.name)
+                    changed.append(self.configure_channel(bridged, options))
+                    new_channels[channel.id] = bridged
+            await asyncio.gather(*changed)
+            # If any of the channels have gone away, clear them out on IRC as well.
+            for id, channel in self.channels.items():
+                if id not in new_channels:
+                    print("  -", channel.name)
+                    channel.clear()
+            if list(new_channels) != list(self.channels):
+                # Channels were added, removed or reordered.
+                self.list_cache = None
+            self.channels = new_channels
+            self.channel_ids = {c.name: id for id, c in new_channels.items()}
+            if self.hub and self.ready:
+                for link in self.hub.links:
+                    link.send(self.snapshot(link))
+
+    async def configure_channel(self, channel, options):
+        async with self.rest_limit:
+            await channel.configure(self.bridge, **options)
+            await channel.sync(self.bridge)
+
+    def schedule_reconfigure(self, channel):
+        # Bursts of channel events are merged into one reconfigure once they stop
+        # for reconfigure_delay seconds, or after ten times that at most.
+        now = self.loop.time()
+        if self.reconfigure_timer:
+            self.reconfigure_timer.cancel()
+        else:
+            self.reconfigure_deadline = now + self.reconfigure_delay * 10
+        self.reconfigure_ids.add(channel.id)
+        delay = min(self.reconfigure_delay, self.reconfigure_deadline - now)
+        self.reconfigure_timer = self.loop.call_later(delay, self.run_reconfigure)
+
+    def run_reconfigure(self):
+        ids, self.reconfigure_ids = self.reconfigure_ids, set()
+        self.reconfigure_timer = None
+        self.stats["reconfigure.channels"] += len(ids)
+        self.stats["reconfigure.runs"] += 1
+        asyncio.create_task(self.reconfigure(ids))
 
     async def bridge_ready(self):
+        self.nicknames.reset_members(self.bridge.guild.members)
+        if self.db:
+            await self.db.assign_channels(
+                {c.name: c.id for c in self.bridge.guild.text_channels}
+            )
         await self.reconfigure()
-        if not self.server.is_serving():
+        if self.hub:
+            if not self.ready:
+                self.ready = True
+                for link in self.hub.links:
+                    link.send(self.snapshot(link))
+                print(f"Serving {self.workers} workers on {self.ipc_path}")
+        elif not self.server.is_serving():
             await self.server.start_serving()
             print(f"Listening on {self.host}:{self.port}")
 
-    async def sync_channels(self):
+    def sync_member(self, event, member, present=True):
+        # Only this member's presence is checked, once per bridged channel.
+        work = Counter()
         for channel in self.channels.values():
+            discord_channel = self.bridge.get_channel(channel.id)
+            visible = (
+                present
+                and discord_channel is not None
+                and discord_channel.permissions_for(member).read_messages
+            )
+            work["channels"] += 1
+            change = channel.update_member(member, visible)
+            if change:
+                work[change] += 1
+        for kind, count in work.items():
+            self.stats[f"{event}.{kind}"] += count
+        self.stats[f"{event}.events"] += 1
+        logging.debug(
+            "%s %s: checked %d channels, %d joins, %d parts",
+            event,
+            member,
+            work["channels"],
+            work["join"],
+            work["part"],
+        )
+
+    async def channel_updated(self, before, after):
+        channel = self.channels.get(after.id)
+        if channel:
+            if channel.name != after.name:
+                self.rename_channel(channel, after.name)
+                if not self.automap:
+                    # It may not be mapped under its new name.
+                    self.schedule_reconfigure(after)
             await channel.sync(self.bridge)
+            self.stats["channel_update.channels"] += 1
+
+    def listing(self):
+        """
+        Returns the LIST line of every channel (see encode_reply) in order,
+        with an index of them for ELIST filters: the user counts in ascending
+        order, and (users, position, folded name, topic time, line) entries in
+        the same order. Both are kept until a channel changes.
+        """
+        if self.list_cache is None:
+            entries = []
+            for position, channel in enumerate(self.channels.values()):
+                users = channel.num_users
+                line = encode_reply(
+                    RPL.LIST,
+                    channel.irc_name,
+                    str(users),
+                    channel.topic,
+                    prefix=self.name,
+                )
+                name = casefold(channel.irc_name)
+                entries.append((users, position, name, channel.topic_time, line))
+            lines = [entry[-1] for entry in entries]
+            entries.sort()
+            counts = [entry[0] for entry in entries]
+            self.list_cache = (lines, counts, entries)
+        return self.list_cache
+
+    def list_lines(self, query=None):
+        """
+        Returns the LIST lines of the channels matching an ELIST query: comma
+        separated channel masks (any of which may match), and conditions that
+        must all hold: !mask, >users, <users, T<minutes and T>minutes since the
+        topic changed.
+        """
+        lines, counts, entries = self.listing()
+        if not query:
+            return lines
+        low = 0
+        high = len(entries)
+        masks = []
+        excluded = []
+        changed_after = changed_before = None
+        now = datetime.now(timezone.utc).timestamp()
+        for item in query.split(","):
+            try:
+                if item.startswith(">"):
+                    low = max(low, bisect_right(counts, int(item[1:])))
+                elif item.startswith("<"):
+                    high = min(high, bisect_left(counts, int(item[1:])))
+                elif item[:2].upper() == "T<":
+                    changed_after = now - int(item[2:]) * 60
+                elif item[:2].upper() == "T>":
+                    changed_before = now - int(item[2:]) * 60
+                elif item.startswith("!"):
+                    excluded.append(mask_pattern(item[1:]))
+                elif item:
+                    masks.append(mask_pattern(item))
+            except ValueError:
+                pass
+        selected = []
+        for users, position, name, topic_time, line in entries[low:high]:
+            if masks and not any(mask.fullmatch(name) for mask in masks):
+                continue
+            if any(mask.fullmatch(name) for mask in excluded):
+                continue
+            if changed_after is not None and topic_time <= changed_after:
+                continue
+            if changed_before is not None and topic_time >= changed_before:
+                continue
+            selected.append((position, line))
+        selected.sort()
+        return [line for position, line in selected]
+
+    def rename_channel(self, channel, name):
+        if self.channel_ids.get(channel.name) == channel.id:
+            del self.channel_ids[channel.name]
+        self.channel_ids[name] = channel.id
+        channel.rename(name)
 
     async def connected(self, session):
-        self.sessions.append(session)
+        self.sessions[session] = None
 
     async def disconnected(self, session):
-        for channel in self.channels.values():
-            channel.quit(session, session.quit_reason)
-        self.sessions.remove(session)
+        self.quit(session, session.quit_reason, list(session.channels))
+        self.sessions.pop(session, None)
+        self.nicknames.remove_session(session)
+
+    def peers(self, channels):
+        # The sessions in any of channels, each once.
+        sessions = {}
+        for channel in channels:
+            sessions.update(channel.sessions)
+        return sessions
+
+    def quit(self, user, reason, channels):
+        for channel in channels:
+            channel.quit(user)
+        data = encode("QUIT", reason, prefix=user)
+        for session in self.peers(channels):
+            session.send(data)
+
+    def nick_changed(self, session, old_nickname):
+        self.nicknames.rename_session(session, old_nickname)
+        for channel in session.channels:
+            channel.invalidate()
+
+    def index_member(self, member, present=True):
+        old = self.nicknames.member_nicks.get(member.id)
+        if present:
+            self.nicknames.add_member(member)
+        else:
+            self.nicknames.remove_member(member)
+        new = self.nicknames.member_nicks.get(member.id)
+        if self.hub and old != new:
+            self.hub.publish(("member", old, new))
+
+    async def member_joined(self, member):
+        self.index_member(member)
+        self.sync_member("member_join", member)
+
+    async def member_removed(self, member):
+        self.index_member(member, present=False)
+        self.sync_member("member_remove", member, present=False)
+
+    def member_renamed(self, old_nickname, user, channels):
+        """
+        Tells the sessions sharing any of channels with a Discord member that
+        they changed their display name, here and in the worker processes.
+        """
+        if self.hub:
+            self.hub.publish(("rename", old_nickname, RemoteUser.of(user)))
+        data = encode("NICK", user.nickname, prefix=old_nickname)
+        for session in self.peers(channels):
+            session.send(data)
+
+    async def member_updated(self, before, after):
+        self.index_member(after)
+        self.sync_member("member_update", after)
+        if before.status != after.status:
+            channels = [c for c in self.channels.values() if after.name in c.members]
+            reason = AWAY_STATUSES.get(str(after.status))
+            self.away_changed(UserProxy(after), reason, channels)
+
+    def away_changed(self, user, reason, channels=None):
+        """
+        Tells the away-notify sessions sharing a channel with user that it is
+        away, or back if reason is None.
+        """
+        if self.hub:
+            self.hub.publish(("away", RemoteUser.of(user), reason))
+        if channels is None:
+            channels = user.channels
+        data = encode("AWAY", *([reason] if reason else []), prefix=user)
+        for session in self.peers(channels):
+            if session is not user and "away-notify" in session.caps:
+                session.send(data)
 
     async def log(self, message):
         if self.db:
-            params = [
-                message.id,
-                int(message.created_at.timestamp()),
-                message.channel.name,
-                message.author.display_name,
-                message.clean_content,
-            ]
-            try:
-                await self.db.execute(
-                    """
-                    INSERT INTO logs (id, timestamp, channel, nickname, message)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    params,
+            self.db.add(
+                (
+                    message.id,
+                    int(message.created_at.timestamp()),
+                    message.channel.id,
+                    message.channel.name,
+                    message.author.display_name,
+                    message.clean_content,
                 )
-            except Exception:
-                print("LOG FAILED:", params, file=sys.stderr)
+            )
 
-    def valid_nick(self, nick):
-        for session in self.sessions:
-            if session.nickname == nick:
-                return False
-        for member in self.bridge.guild.members:
-            if UserProxy(member).nickname == nick:
-                return False
-        return True
+    def valid_nick(self, nick, session=None):
+        return self.nicknames.available(nick, session=session)
+
+    async def claim_nick(self, nick, session=None):
+        return self.valid_nick(nick, session)
 
     def user(self, nick):
-        for session in self.sessions:
-            if session.nickname == nick:
-                return session
-        return None
+        return self.nicknames.session(nick)
+
+    def snapshot(self, link):
+        # Everything a worker needs to know about the users it doesn't serve.
+        channels = [
+            (
+                channel.id,
+                channel.name,
+                channel.topic or "",
+                channel.topic_time,
+                [RemoteUser.of(user) for user in channel.members.values()]
+                + [
+                    RemoteUser.of(user)
+                    for user in channel.remote.values()
+                    if user.link is not link
+                ],
+            )
+            for channel in self.channels.values()
+        ]
+        users = [
+            RemoteUser.of(user)
+            for user in self.remote_users.values()
+            if user.link is not link
+        ]
+        return ("channels", channels, dict(self.nicknames.members), users)
+
+    def worker_connected(self, link):
+        if self.ready:
+            link.send(self.snapshot(link))
+
+    def worker_disconnected(self, link):
+        for folded, owner in list(self.claims.items()):
+            if owner is link:
+                del self.claims[folded]
+        for user in list(self.remote_users.values()):
+            if user.link is link:
+                self.worker_quit(link, user.nickname, "Worker exited")
+                self.hub.publish(("quit", user.nickname, "Worker exited"))
+
+    def worker_event(self, link, event):
+        handler = getattr(self, "worker_" + event[0], None)
+        if handler:
+            handler(link, *event[1:])
+        # Everything workers tell the core is news to the other workers.
+        if event[0] == "msg":
+            stamp = datetime.now(timezone.utc).timestamp()
+            self.hub.publish(event + (stamp, None), skip=link)
+        elif event[0] not in ("dm", "claim", "release"):
+            self.hub.publish(event, skip=link)
+
+    def worker_claim(self, link, nickname, old_nickname):
+        # Workers only know about each other's users after the fact, so the core
+        # decides who gets a nickname before a worker accepts a NICK.
+        folded = casefold(nickname)
+        owner = self.remote_users.get(folded)
+        taken = (
+            folded in self.claims
+            or not self.nicknames.available(nickname)
+            or (owner and (owner.link is not link or owner.nickname != old_nickname))
+        )
+        if not taken:
+            self.claims[folded] = link
+        link.send(("claimed", nickname, not taken))
+
+    def worker_release(self, link, nickname):
+        if self.claims.get(casefold(nickname)) is link:
+            del self.claims[casefold(nickname)]
+
+    def worker_nick(self, link, old_nickname, user, announce):
+        self.worker_release(link, user[0])
+        old = self.remote_users.pop(casefold(old_nickname), None)
+        new = self.remote_users[casefold(user[0])] = RemoteUser(*user, link=link)
+        if old:
+            new.channels = old.channels
+            for id in old.channels:
+                channel = self.channels.get(id)
+                if channel and channel.remote.pop(old_nickname, None):
+                    channel.remote[new.nickname] = new
+                    channel.invalidate()
+
+    def worker_join(self, link, id, user):
+        channel = self.channels.get(id)
+        remote = self.remote_users.get(casefold(user[0]))
+        if channel and remote:
+            channel.remote[remote.nickname] = remote
+            channel.invalidate()
+            remote.channels.add(id)
+
+    def worker_part(self, link, id, nickname, reason):
+        channel = self.channels.get(id)
+        remote = self.remote_users.get(casefold(nickname))
+        if channel and remote:
+            channel.remote.pop(nickname, None)
+            channel.invalidate()
+            remote.channels.discard(id)
+
+    def worker_quit(self, link, nickname, reason):
+        remote = self.remote_users.pop(casefold(nickname), None)
+        if remote:
+            for id in remote.channels:
+                if id in self.channels:
+                    self.channels[id].quit(remote)
+
+    def worker_msg(self, link, id, user, content):
+        channel = self.channels.get(id)
+        if channel and user[0] in channel.remote:
+            channel.relay(channel.remote[user[0]], content)
+
+    def worker_dm(self, link, nickname, sender, content):
+        remote = self.remote_users.get(casefold(nickname))
+        if remote:
+            remote.link.send(("dm", nickname, sender, content))
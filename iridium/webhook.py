@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from collections import Counter, deque
+
+# Discord rejects messages longer than this.
+MESSAGE_LIMIT = 2000
+
+
+class WebhookQueue:
+    """
+    Ordered outbound queue of IRC lines for a channel's webhook. Lines are sent
+    one message at a time, no more than rate messages every per seconds, and
+    consecutive lines from the same nickname that are waiting are merged into
+    a single message.
+    """
+
+    def __init__(self, send, rate=5, per=2.0, stats=None):
+        self.send = send
+        self.rate = rate
+        self.per = per
+        self.stats = Counter() if stats is None else stats
+        # (username, text, time queued) for each line waiting to be sent.
+        self.pending = deque()
+        # When the last rate messages were sent.
+        self.sent = deque(maxlen=rate)
+        # Moving average of seconds from queueing a line to Discord accepting it.
+        self.latency = 0.0
+        self.max_depth = 0
+        self.worker = None
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def put(self, username, text):
+        now = asyncio.get_running_loop().time()
+        for start in range(0, len(text), MESSAGE_LIMIT):
+            end = start + MESSAGE_LIMIT
+            self.pending.append((username, text[start:end], now))
+        self.stats["webhook.lines"] += 1
+        self.max_depth = max(self.max_depth, len(self.pending))
+        if self.worker is None:
+            self.worker = asyncio.create_task(self.run())
+
+    def take(self):
+        username, content, queued = self.pending.popleft()
+        while self.pending and self.pending[0][0] == username:
+            text = self.pending[0][1]
+            if len(content) + 1 + len(text) > MESSAGE_LIMIT:
+                break
+            content += "\n" + text
+            self.pending.popleft()
+            self.stats["webhook.merged"] += 1
+        return username, content, queued
+
+    async def throttle(self):
+        loop = asyncio.get_running_loop()
+        if len(self.sent) == self.rate:
+            wait = self.sent[0] + self.per - loop.time()
+            if wait > 0:
+                self.stats["webhook.throttled"] += 1
+                await asyncio.sleep(wait)
+        self.sent.append(loop.time())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending:
+                await self.throttle()
+                username, content, queued = self.take()
+                try:
+                    await self.send(content, username)
+                    self.stats["webhook.sent"] += 1
+                except Exception:
+                    self.stats["webhook.errors"] += 1
+                    logging.exception("Webhook send failed")
+                self.latency = 0.8 * self.latency + 0.2 * (loop.time() - queued)
+        finally:
+            self.worker = None
@@ -0,0 +1,238 @@
+import asyncio
+import os
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from .ipc import RemoteUser, connect
+from .irc import IRCSession, casefold, encode
+from .log import MessageLog
+from .server import BridgeChannel, Server
+
+
+class WorkerChannel(BridgeChannel):
+    """
+    A bridged channel as a worker process sees it. Its own IRC sessions are in
+    sessions, everybody else (Discord members and IRC users of other workers)
+    is in remote, and what its sessions do is sent on to the core process.
+    """
+
+    def join(self, user):
+        if isinstance(user, IRCSession):
+            if user not in self.sessions:
+                self.server.link.send(("join", self.id, RemoteUser.of(user)))
+        else:
+            self.remote[user.nickname] = user
+        super().join(user)
+
+    def part(self, user, reason):
+        if isinstance(user, IRCSession):
+            if user in self.sessions:
+                self.server.link.send(("part", self.id, user.nickname, reason))
+        else:
+            self.remote.pop(user.nickname, None)
+        super().part(user, reason)
+
+    def relay(self, sender, content):
+        self.server.link.send(("msg", self.id, RemoteUser.of(sender), content))
+
+
+class WorkerServer(Server):
+    """
+    Serves IRC clients in one of several worker processes sharing the IRC port
+    with SO_REUSEPORT. The core process owns the Discord client and the message
+    log, and keeps each worker up to date with events sent over link.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.link = None
+        # Futures for the nickname claims sent to the core, oldest first.
+        self.claims = deque()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await self.loop.create_server(
+            lambda: IRCSession(self),
+            host=self.host,
+            port=self.port,
+            reuse_port=True,
+            start_serving=False,
+        )
+        self.link = await connect(self.ipc_path)
+        options = self.config.get("logging", {})
+        if options.get("messages"):
+            self.db = MessageLog(options["messages"], readonly=True)
+            await self.db.open()
+
+    async def run(self):
+        await self.start()
+        try:
+            await self.link.run(self.event)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        self.server.close()
+        for session in self.sessions:
+            session.transport.close()
+        await self.server.wait_closed()
+        if self.db:
+            await self.db.close()
+
+    def event(self, event):
+        handler = getattr(self, "event_" + event[0], None)
+        if handler:
+            handler(*event[1:])
+
+    def event_channels(self, channels, members, users):
+        self.nicknames.members = Counter(members)
+        self.remote_users = {
+            casefold(user[0]): RemoteUser(*user, link=self.link) for user in users
+        }
+        new_channels = {}
+        for id, name, topic, topic_time, remote in channels:
+            channel = self.channels.get(id)
+            if channel is None:
+                channel = WorkerChannel(name, server=self, id=id)
+            elif channel.name != name:
+                channel.rename(name)
+            users = [RemoteUser.of(user) for user in channel.remote.values()]
+            if (topic, topic_time, remote) != (
+                channel.topic,
+                channel.topic_time,
+                users,
+            ):
+                channel.topic = topic
+                channel.topic_time = topic_time
+                channel.remote = {user[0]: RemoteUser(*user) for user in remote}
+                channel.invalidate()
+            new_channels[id] = channel
+        for id, channel in self.channels.items():
+            if id not in new_channels:
+                channel.clear()
+        if list(new_channels) != list(self.channels):
+            self.list_cache = None
+        self.channels = new_channels
+        self.channel_ids = {c.name: id for id, c in new_channels.items()}
+        if not self.server.is_serving():
+            asyncio.create_task(self.server.start_serving())
+            print(f"Listening on {self.host}:{self.port} (worker {os.getpid()})")
+
+    def event_join(self, id, user):
+        channel = self.channels.get(id)
+        if channel and user[0] not in channel.remote:
+            channel.join(RemoteUser(*user))
+
+    def event_part(self, id, nickname, reason):
+        channel = self.channels.get(id)
+        if channel and nickname in channel.remote:
+            channel.part(channel.remote[nickname], reason)
+
+    def event_quit(self, nickname, reason):
+        self.remote_users.pop(casefold(nickname), None)
+        channels = [c for c in self.channels.values() if nickname in c.remote]
+        if channels:
+            self.quit(channels[0].remote[nickname], reason, channels)
+
+    def event_nick(self, old_nickname, user, announce):
+        self.remote_users.pop(casefold(old_nickname), None)
+        self.remote_users[casefold(user[0])] = RemoteUser(*user, link=self.link)
+        self.rename_remote(old_nickname, user, announce)
+
+    def event_renamed(self, id, name):
+        channel = self.channels.get(id)
+        if channel:
+            self.rename_channel(channel, name)
+
+    def event_rename(self, old_nickname, user):
+        # Discord members changing their display name.
+        self.rename_remote(old_nickname, user)
+
+    def rename_remote(self, old_nickname, user, announce=True):
+        channels = []
+        for channel in self.channels.values():
+            if channel.remote.pop(old_nickname, None):
+                channel.remote[user[0]] = RemoteUser(*user)
+                channel.invalidate()
+                channels.append(channel)
+        if announce:
+            data = encode("NICK", user[0], prefix=old_nickname)
+            for session in self.peers(channels):
+                session.send(data)
+
+    def event_claimed(self, nickname, granted):
+        future = self.claims.popleft()
+        if future.cancelled():
+            if granted:
+                self.link.send(("release", nickname))
+        else:
+            future.set_result(granted)
+
+    def event_member(self, old, new):
+        if old is not None:
+            self.nicknames.members[old] -= 1
+            if not self.nicknames.members[old]:
+                del self.nicknames.members[old]
+        if new is not None:
+            self.nicknames.members[new] += 1
+
+    def event_topic(self, id, topic):
+        channel = self.channels.get(id)
+        if channel:
+            channel.topic = topic
+            channel.topic_time = datetime.now(timezone.utc).timestamp()
+            channel.invalidate()
+            for session in channel.sessions:
+                session.write("TOPIC", channel.irc_name, topic)
+
+    def event_msg(self, id, user, content, time, msgid):
+        channel = self.channels.get(id)
+        if channel:
+            channel.message(content, sender=RemoteUser(*user), time=time, msgid=msgid)
+
+    def event_dm(self, nickname, sender, content):
+        session = self.nicknames.session(nickname)
+        if session:
+            session.message(content, sender=RemoteUser(*sender))
+
+    def event_away(self, user, reason):
+        channels = [c for c in self.channels.values() if user[0] in c.remote]
+        self.away_changed(RemoteUser(*user), reason, channels)
+
+    async def disconnected(self, session):
+        await super().disconnected(session)
+        if session.nickname:
+            self.link.send(("quit", session.nickname, session.quit_reason))
+
+    def nick_changed(self, session, old_nickname):
+        super().nick_changed(session, old_nickname)
+        user = RemoteUser.of(session)
+        self.link.send(("nick", old_nickname, user, session.authenticated))
+
+    def away_changed(self, user, reason, channels=None):
+        if isinstance(user, IRCSession):
+            self.link.send(("away", RemoteUser.of(user), reason))
+        super().away_changed(user, reason, channels)
+
+    def valid_nick(self, nick, session=None):
+        return super().valid_nick(nick, session) and (
+            casefold(nick) not in self.remote_users
+        )
+
+    async def claim_nick(self, nick, session=None):
+        if not self.valid_nick(nick, session):
+            return False
+        future = self.loop.create_future()
+        self.claims.append(future)
+        self.link.send(("claim", nick, session.nickname if session else None))
+        return await future
+
+    def user(self, nick):
+        return super().user(nick) or self.remote_users.get(casefold(nick))
+
+
+def run_worker(config):
+    try:
+        asyncio.run(WorkerServer(config).run())
+    except KeyboardInterrupt:
+        pass
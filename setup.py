@@ -31,7 +31,7 @@ setup(
     author_email="dcwatson@gmail.com",
     url="https://github.com/dcwatson/iridium",
     license="MIT",
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests"]),
     install_requires=get_requirements(),
     entry_points={
         "console_scripts": [
@@ -0,0 +1,193 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from iridium.commands import Context, issue, weather
+
+WEATHER = {
+    "coord": {"lat": 40.7128, "lon": -74.0061},
+    "main": {"temp": 50.0, "feels_like": 41.0},
+    "sys": {"country": "US"},
+    "name": "New York",
+    "weather": [{"description": "light rain"}],
+}
+
+AIR_QUALITY = [
+    {"AQI": 20, "ParameterName": "O3", "Category": {"Name": "Good"}},
+    {"AQI": 60, "ParameterName": "PM2.5", "Category": {"Name": "Moderate"}},
+]
+
+
+class Message:
+    def __init__(self):
+        self.replies = []
+
+    async def reply(self, text):
+        self.replies.append(text)
+
+
+class Server:
+    # The parts of iridium.server.Server a Context uses.
+    def __init__(self, http):
+        self.http = http
+
+
+class CommandTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    Runs command handlers against a local aiohttp server, with a Context whose
+    HTTP session is a real aiohttp.ClientSession.
+    """
+
+    async def asyncSetUp(self):
+        self.requests = []
+        self.app = web.Application()
+        self.routes()
+        self.server = TestServer(self.app)
+        await self.server.start_server()
+        self.http = aiohttp.ClientSession()
+        self.context = Context(Server(self.http))
+
+    async def asyncTearDown(self):
+        await self.http.close()
+        await self.server.close()
+
+    def routes(self):
+        pass
+
+    def url(self, path):
+        return str(self.server.make_url(path))
+
+
+class WeatherTests(CommandTestCase):
+    def routes(self):
+        self.app.router.add_get("/weather", self.weather)
+        self.app.router.add_get("/aqi", self.air_quality)
+        self.delay = 0
+        self.status = 200
+
+    async def weather(self, request):
+        self.requests.append(("weather", dict(request.query)))
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response(WEATHER)
+
+    async def air_quality(self, request):
+        self.requests.append(("aqi", dict(request.query)))
+        return web.json_response(AIR_QUALITY)
+
+    async def handle(self, *args, **options):
+        message = Message()
+        with mock.patch.multiple(
+            weather, ENDPOINT=self.url("/weather"), AQI_ENDPOINT=self.url("/aqi")
+        ):
+            await weather.handle(
+                message, *args, appid="key", context=self.context, **options
+            )
+        return message.replies
+
+    async def test_reply(self):
+        replies = await self.handle("New", "York")
+        self.assertEqual(
+            replies,
+            ["Currently in New York: 50.00°F (feels like 41.00°F) and light rain"],
+        )
+        self.assertEqual(
+            self.requests,
+            [("weather", {"units": "imperial", "appid": "key", "q": "new york"})],
+        )
+
+    async def test_air_quality(self):
+        replies = await self.handle("10001", airnow="secret")
+        self.assertTrue(replies[0].endswith("(AQI = 60 [PM2.5] - Moderate)"))
+        self.assertEqual(self.requests[0][1]["zip"], "10001")
+        self.assertEqual(self.requests[1][1]["latitude"], "40.71")
+        self.assertEqual(self.requests[1][1]["longitude"], "-74.01")
+
+    async def test_cached(self):
+        await self.handle("New", "York", airnow="secret")
+        replies = await self.handle("new  york", airnow="secret")
+        self.assertEqual(len(replies), 1)
+        self.assertEqual([name for name, _ in self.requests], ["weather", "aqi"])
+
+    async def test_shared_request(self):
+        # Lookups of the same place while one is in flight wait for it.
+        self.delay = 0.05
+        results = await asyncio.gather(*(self.handle("Paris") for _ in range(5)))
+        self.assertEqual([len(replies) for replies in results], [1] * 5)
+        self.assertEqual(len(self.requests), 1)
+        stats = self.context.cache("weather", 600).stats
+        self.assertEqual(stats["weather.misses"], 1)
+        self.assertEqual(stats["weather.shared"], 4)
+
+    async def test_errors_not_cached(self):
+        self.status = 500
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await self.handle("Paris")
+        self.status = 200
+        self.assertEqual(len(await self.handle("Paris")), 1)
+        self.assertEqual(len(self.requests), 2)
+
+    async def test_no_appid(self):
+        message = Message()
+        await weather.handle(message, "Paris", context=self.context)
+        self.assertEqual(message.replies, [])
+        self.assertEqual(self.requests, [])
+
+
+class IssueTests(CommandTestCase):
+    def routes(self):
+        self.app.router.add_post("/repos/{owner}/{name}/issues", self.create)
+
+    async def create(self, request):
+        self.requests.append(
+            (request.path, request.headers.get("Authorization"), await request.json())
+        )
+        return web.json_response(
+            {"html_url": "https://github.com/avaraline/iridium/issues/1"}
+        )
+
+    async def handle(self, *args, **options):
+        message = Message()
+        endpoint = self.url("/repos/") + "{}/issues"
+        with mock.patch.object(issue, "ENDPOINT", endpoint):
+            await issue.handle(
+                message,
+                *args,
+                user="bot",
+                token="secret",
+                repo="avaraline/iridium",
+                context=self.context,
+                **options,
+            )
+        return message.replies
+
+    async def test_labels_from_title(self):
+        replies = await self.handle("Crash", "on", "[bug]", "join", labels=["irc"])
+        self.assertEqual(replies, ["https://github.com/avaraline/iridium/issues/1"])
+        path, auth, data = self.requests[0]
+        self.assertEqual(path, "/repos/avaraline/iridium/issues")
+        self.assertEqual(auth, aiohttp.BasicAuth("bot", "secret").encode())
+        self.assertEqual(data, {"title": "Crash on  join", "labels": ["irc", "bug"]})
+
+    async def test_title_and_body(self):
+        labels = ["irc"]
+        await self.handle("Crash", "It crashed [badly]", labels=labels)
+        await self.handle("Again")
+        self.assertEqual(
+            [data for _, _, data in self.requests],
+            [
+                {"title": "Crash", "body": "It crashed [badly]", "labels": ["irc"]},
+                {"title": "Again"},
+            ],
+        )
+        # The configured labels are not changed by an invocation.
+        self.assertEqual(labels, ["irc"])
+
+
+if __name__ == "__main__":
+    unittest.main()
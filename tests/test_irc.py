@@ -0,0 +1,184 @@
+import random
+import unittest
+
+from iridium.constants import RPL
+from iridium.irc import (
+    MAX_LINE,
+    NICK_ROOM,
+    encode,
+    encode_list_reply,
+    encode_multiline,
+    encode_reply,
+    parse_tags,
+    split_lines,
+    split_text,
+)
+
+PREFIX = "irc.example.com"
+ALPHABETS = [
+    "abcdefghijklmnopqrstuvwxyz     ",
+    "abc",
+    "é ü ß ж",
+    "日本語のテキスト 中文",
+    "🎉👍🏽🤖 a",
+    "a\n b\r\n",
+]
+
+
+def send(code, lines, nickname):
+    # What IRCSession.send_reply writes for lines encoded for any client.
+    head = ":{} {} {}".format(PREFIX, code, nickname).encode("utf-8")
+    return [head + line for line in lines]
+
+
+def items(line):
+    return line[:-2].decode("utf-8").split(" :", 1)[1].split()
+
+
+def random_text(rng, length=3000):
+    alphabet = rng.choice(ALPHABETS)
+    return "".join(rng.choice(alphabet) for _ in range(rng.randrange(0, length)))
+
+
+def reassemble(data):
+    # The text of a draft/multiline batch, and its lines without message tags.
+    text = None
+    lines = []
+    for raw in data.decode("utf-8").split("\r\n")[:-1]:
+        lines.append(raw)
+        if not raw.startswith("@"):
+            continue
+        tags, _, rest = raw[1:].partition(" ")
+        lines[-1] = rest
+        content = rest.split(" :", 1)[1]
+        if text is None:
+            text = content
+        elif "draft/multiline-concat" in parse_tags(tags):
+            text += content
+        else:
+            text += "\n" + content
+    return text, lines
+
+
+class SplitTests(unittest.TestCase):
+    """
+    Fuzzes the outbound line splitter with random text in several scripts and
+    random prefix lengths.
+    """
+
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def assertFits(self, data):
+        self.assertTrue(data.endswith(b"\r\n"))
+        for line in data.split(b"\r\n")[:-1]:
+            self.assertLessEqual(len(line) + 2, MAX_LINE)
+            self.assertNotIn(b"\n", line)
+            self.assertNotIn(b"\r", line)
+            line.decode("utf-8")
+
+    def prefix(self):
+        return "x" * self.rng.randrange(1, 200) + "!user@discord.gg"
+
+    def test_split_text(self):
+        for _ in range(500):
+            text = random_text(self.rng)
+            width = self.rng.randrange(1, 600)
+            chunks = split_text(text, width)
+            self.assertTrue(all(len(chunk) <= max(width, 16) for chunk in chunks))
+            # Chunks decode on their own, so no character is broken, and those
+            # of each line concatenate to the line without empty chunks between.
+            decoded = [chunk.decode("utf-8") for chunk in chunks]
+            self.assertEqual("".join(decoded), "".join(split_lines(text)))
+            self.assertTrue(all(decoded) or decoded == [""])
+
+    def test_encode(self):
+        for _ in range(500):
+            text = random_text(self.rng)
+            prefix = self.prefix()
+            self.assertFits(encode("PRIVMSG", "#general", text, prefix=prefix))
+            # Other commands get one line, cut to fit.
+            data = encode("TOPIC", "#general", text, prefix=prefix)
+            self.assertFits(data)
+            self.assertEqual(data.count(b"\r\n"), 1)
+
+    def test_encode_multiline(self):
+        for _ in range(500):
+            text = random_text(self.rng)
+            data = encode_multiline("#general", text, self.prefix())
+            # Message tags don't count towards MAX_LINE.
+            result, lines = reassemble(data)
+            self.assertEqual(result, "\n".join(split_lines(text)))
+            self.assertTrue(all(len(line) + 2 <= MAX_LINE for line in lines))
+
+    def test_encode_list_reply(self):
+        for _ in range(500):
+            names = random_text(self.rng, 2000).split()
+            names = [name[:NICK_ROOM] for name in names if "\r" not in name]
+            prefix = "x" * self.rng.randrange(1, 200)
+            nickname = "n" * self.rng.randrange(1, NICK_ROOM + 1)
+            data = encode_list_reply(
+                RPL.NAMREPLY, "=", "#general", items=names, prefix=prefix
+            )
+            head = ":{} {} {}".format(prefix, RPL.NAMREPLY, nickname).encode("utf-8")
+            lines = [head + line for line in data]
+            self.assertTrue(all(len(line) <= MAX_LINE for line in lines))
+            self.assertEqual(sum((items(line) for line in lines), []), names)
+
+
+class ListReplyTests(unittest.TestCase):
+    def test_line_at_limit(self):
+        # One item exactly as wide as a line allows for the longest nickname.
+        nickname = "n" * NICK_ROOM
+        empty = send(
+            RPL.NAMREPLY,
+            encode_list_reply(RPL.NAMREPLY, "=", "#c", items=[], prefix=PREFIX),
+            nickname,
+        )[0]
+        names = ["a" * (MAX_LINE - len(empty)), "b"]
+        lines = send(
+            RPL.NAMREPLY,
+            encode_list_reply(RPL.NAMREPLY, "=", "#c", items=names, prefix=PREFIX),
+            nickname,
+        )
+        self.assertEqual(len(lines[0]), MAX_LINE)
+        self.assertEqual([items(line) for line in lines], [names[:1], names[1:]])
+
+    def test_all_lengths(self):
+        nickname = "n" * NICK_ROOM
+        for length in range(1, 40):
+            names = [f"{n:0{length}}"[-length:] for n in range(400)]
+            data = encode_list_reply(
+                RPL.NAMREPLY, "=", "#c", items=names, prefix=PREFIX
+            )
+            lines = send(RPL.NAMREPLY, data, nickname)
+            self.assertTrue(all(len(line) <= MAX_LINE for line in lines))
+            self.assertEqual(sum((items(line) for line in lines), []), names)
+
+    def test_reply_fits(self):
+        topic = "x" * 1000
+        line = send(
+            RPL.LIST,
+            [encode_reply(RPL.LIST, "#c", 3, topic, prefix=PREFIX)],
+            "n" * NICK_ROOM,
+        )[0]
+        self.assertEqual(len(line), MAX_LINE)
+
+    def test_longer_nickname(self):
+        # Replies can be encoded for a nickname over NICK_ROOM bytes.
+        room = 200
+        nickname = "n" * room
+        names = [f"name{n}" for n in range(200)]
+        data = encode_list_reply(
+            RPL.NAMREPLY, "=", "#c", items=names, prefix=PREFIX, room=room
+        )
+        lines = send(RPL.NAMREPLY, data, nickname)
+        self.assertTrue(all(len(line) <= MAX_LINE for line in lines))
+        self.assertEqual(sum((items(line) for line in lines), []), names)
+        reply = encode_reply(RPL.WHOREPLY, "x" * 1000, prefix=PREFIX, room=room)
+        line = send(RPL.WHOREPLY, [reply], nickname)[0]
+        self.assertEqual(len(line), MAX_LINE)
+
+
+if __name__ == "__main__":
+    unittest.main()